@@ -1,4 +1,4 @@
-from typing import Tuple, List
+from typing import Tuple, List, Union
 from enum import Enum, auto
 
 import search
@@ -73,14 +73,16 @@ unmovable_tile_types = (
 # Actions type is a tuple of varying size of Action
 # Each Action is a tuple with ((y,x), direction), a tile (only empty-cell) position
 # and a direction to move.
-State = bytes
+# With track_empties the State is a (board, empties) tuple, empties being the
+# sorted tuple of the 1d indexes of the empty-cells.
+State = Union[bytes, Tuple[bytes, Tuple[int, ...]]]
 Location = Tuple[int, int]
 Action = Tuple[Location, Location]
 Actions = Tuple[Action, ...]
 
 
 class RTBProblem(search.Problem):
-    def __init__(self):
+    def __init__(self, track_empties=False):
         """
         State is a 1d binary object with N*N*TILE_ENCONDING lenght.
         we have 23 diferente types of tiles, so we need at least 5 bits to encode all of each tile types.
@@ -88,8 +90,11 @@ class RTBProblem(search.Problem):
         left corner of the grid, and (N-1, N-1) is the lower right corner.
         We use integer division and modulo aritmetics to translate y,x coordenates 
         to 1 dimension index in the state representation.
+        With track_empties the state also keeps the empty-cells indexes,
+        updated by result, so actions don't need to scan the board.
         """
         self.initial: State = b""
+        self.track_empties = track_empties
         self.algorithm = None
         self.N = 0
         self.init_tile_loc = (0, 0)
@@ -114,7 +119,12 @@ class RTBProblem(search.Problem):
                 board = b"".join([board, *row])
 
         self.initial = board
-        self.init_tile_loc = self._find_init(self.initial)
+        self.init_tile_loc = self._find_init(board)
+        if self.track_empties:
+            empties = tuple(
+                n for n in range(self.N * self.N) if board[n * 5 : n * 5 + 5] == b"10110"
+            )
+            self.initial = (board, empties)
 
     def _loc_to_index(self, loc: Location) -> int:
         return int(self.N * loc[0] + loc[1])
@@ -133,12 +143,16 @@ class RTBProblem(search.Problem):
 
     def result(self, state: State, action: Action) -> State:
         """Return the state that results from executing the given action in the given state."""
+        if self.track_empties:
+            board, empties = state
+        else:
+            board = state
         loc_index = int(self.N * action[0][0] + action[0][1])  # to call only once
         loc_neighbor_index = int(
             self.N * action[1][0] + action[1][1]
         )  # self._loc_to_index(action[1])
 
-        state_list = list(state)
+        state_list = list(board)
 
         # swap elements in a list
         (
@@ -149,6 +163,12 @@ class RTBProblem(search.Problem):
             state_list[loc_index * 5 : loc_index * 5 + 5],
         )
         # transform list back to binary representation.
+        if self.track_empties:
+            # the empty-cell moved to the place of the tile it received
+            empties = tuple(
+                sorted(loc_neighbor_index if n == loc_index else n for n in empties)
+            )
+            return bytes(state_list), empties
         return bytes(state_list)
 
     def actions(self, state: State) -> Actions:
@@ -157,11 +177,15 @@ class RTBProblem(search.Problem):
         """
         actions = []
         # state_list = self._state_to_list(state)
+        if self.track_empties:
+            state, empties = state
 
         def _find_emptys() -> List[Location]:
             """
             return the locations of 'empty-cell' (b"10110") tiles in state
             """
+            if self.track_empties:
+                return [(n // self.N, n % self.N) for n in empties]
             locs = []
 
             for n in range(self.N * self.N):
@@ -216,6 +240,8 @@ class RTBProblem(search.Problem):
 
     def goal_test(self, state) -> bool:
         """Return True if the state is a goal."""
+        if self.track_empties:
+            state = state[0]
         # state_list = self._state_to_list(state)
         #if self.N == 0 and len(state) > 0:
             # remember each state is 5 bits
@@ -55,3 +55,18 @@ def test_public_10():
     with open("public_tests/pub10.dat") as fh:
         assert solve(fh) == 1
 
+
+def test_track_empties():
+    for n in range(1, 11):
+        results = []
+        for track_empties in (False, True):
+            problem = RTBProblem(track_empties)
+            with open("public_tests/pub{:02d}.dat".format(n)) as fh:
+                problem.load(fh)
+            problem.setAlgorithm()
+            solution = problem.solve()
+            if solution is not None:
+                assert problem.goal_test(solution.state)
+                solution = solution.solution()
+            results.append(solution)
+        assert results[0] == results[1]
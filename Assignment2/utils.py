@@ -4,10 +4,12 @@ import bisect
 import collections
 import collections.abc
 import functools
+import hashlib
 import heapq
 import operator
 import os.path
 import random
+import sys
 from itertools import chain, combinations
 from statistics import mean
 
@@ -174,6 +176,49 @@ def scalar_vector_product(x, y):
     return np.multiply(x, y)
 
 
+def min_cost_assignment(cost):
+    """Hungarian algorithm: for an n x m cost matrix with n <= m, return
+    the column assigned to each row, all different, that minimizes the sum
+    of their costs. Keeps the row and column potentials u, v and grows one
+    shortest augmenting path per row, vectorized over the columns, in
+    O(n * n * m)."""
+    cost = np.asarray(cost, dtype=float)
+    n, m = cost.shape
+    if n > m:
+        raise ValueError('min_cost_assignment needs no more rows than columns.')
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    row_of = np.zeros(m + 1, dtype=int)  # 1-based row of each column, 0 if free
+    way = np.zeros(m + 1, dtype=int)
+    for i in range(1, n + 1):
+        row_of[0] = i
+        j0 = 0
+        min_v = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while row_of[j0]:
+            used[j0] = True
+            i0 = row_of[j0]
+            free = ~used
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free[1:] & (reduced < min_v[1:])
+            min_v[1:][better] = reduced[better]
+            way[1:][better] = j0
+            j1 = int(np.argmin(np.where(free, min_v, np.inf)))
+            delta = min_v[j1]
+            u[row_of[used]] += delta
+            v[used] -= delta
+            min_v[free] -= delta
+            j0 = j1
+        while j0:
+            j1 = way[j0]
+            row_of[j0] = row_of[j1]
+            j0 = j1
+    columns = np.empty(n, dtype=int)
+    assigned = np.nonzero(row_of[1:])[0]
+    columns[row_of[1:][assigned] - 1] = assigned
+    return columns
+
+
 def probability(p):
     """Return true with probability p."""
     return p > random.uniform(0.0, 1.0)
@@ -407,16 +452,16 @@ class injection:
 
 def memoize(fn, slot=None, maxsize=32):
     """Memoize fn: make it remember the computed value for any argument list.
-    If slot is specified, store result in that slot of first argument.
+    If slot is specified, store result in that slot of first argument; a
+    slot that is missing or None is computed.
     If slot is false, use lru_cache for caching the values."""
     if slot:
         def memoized_fn(obj, *args):
-            if hasattr(obj, slot):
-                return getattr(obj, slot)
-            else:
+            val = getattr(obj, slot, None)
+            if val is None:
                 val = fn(obj, *args)
                 setattr(obj, slot, val)
-                return val
+            return val
     else:
         @functools.lru_cache(maxsize=maxsize)
         def memoized_fn(*args):
@@ -425,6 +470,51 @@ def memoize(fn, slot=None, maxsize=32):
     return memoized_fn
 
 
+class HeuristicCache:
+    """Heuristic values keyed by state, for searches that evaluate the same
+    state in different nodes: a state reached again by another path, or
+    the subtrees RBFS forgets and searches again. memoize(h, 'h') only
+    keeps the value on the node. The cache holds up to max_bytes, estimated
+    from the size of the states plus ENTRY_BYTES per entry, and evicts the
+    least recently used entries. A cache serves a single heuristic of a
+    single problem; hits, misses and evictions count its lookups."""
+
+    ENTRY_BYTES = 120
+
+    def __init__(self, max_bytes=64 << 20):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.values = collections.OrderedDict()
+
+    def lookup(self, h, node):
+        """Return h(node), computing it only if node.state is not cached."""
+        state = node.state
+        value = self.values.get(state)
+        if value is not None:
+            self.hits += 1
+            self.values.move_to_end(state)
+            return value
+        self.misses += 1
+        value = h(node)
+        self.values[state] = value
+        self.bytes += sys.getsizeof(state) + self.ENTRY_BYTES
+        while self.bytes > self.max_bytes and self.values:
+            evicted, _ = self.values.popitem(last=False)
+            self.bytes -= sys.getsizeof(evicted) + self.ENTRY_BYTES
+            self.evictions += 1
+        return value
+
+    def wrap(self, h):
+        """Return h looking its values up in this cache."""
+        return functools.partial(self.lookup, h)
+
+    def __len__(self):
+        return len(self.values)
+
+
 def name(obj):
     """Try to find some reasonable name for the object."""
     return (getattr(obj, 'name', 0) or getattr(obj, '__name__', 0) or
@@ -714,9 +804,9 @@ class hashabledict(dict):
 
 
 # ______________________________________________________________________________
-# Queues: Stack, FIFOQueue, PriorityQueue
+# Queues: Stack, FIFOQueue, PriorityQueue, IndexedPriorityQueue, BucketQueue
 # Stack and FIFOQueue are implemented as list and collection.deque
-# PriorityQueue is implemented here
+# PriorityQueue, IndexedPriorityQueue and BucketQueue are implemented here
 
 
 class PriorityQueue:
@@ -777,6 +867,318 @@ class PriorityQueue:
         heapq.heapify(self.heap)
 
 
+class IndexedPriorityQueue(PriorityQueue):
+    """A PriorityQueue that also keeps a dict from key(item) to its heap
+    entry, so membership, lookup and deletion don't scan the heap.
+    There is at most one item per key: appending an item whose key is
+    already queued keeps the entry with the best f(x).
+    Deleted or replaced entries stay in the heap as tombstones (they are
+    no longer the entry in the dict) and are skipped by pop.
+    Items with the same f(x) are ordered by tie(x) if given, then oldest
+    first; the items themselves are never compared."""
+
+    def __init__(self, order='min', f=lambda x: x, key=lambda x: x, tie=None):
+        super().__init__(order, f)
+        self.key = key
+        self.tie = tie
+        self.entries = {}
+        self.appended = 0
+
+    def append(self, item):
+        """Insert item at its correct position, unless its key is already
+        queued with a better or equal f(x)."""
+        k = self.key(item)
+        self.appended += 1
+        if self.tie is None:
+            entry = (self.f(item), self.appended, item)
+        else:
+            entry = (self.f(item), self.tie(item), self.appended, item)
+        old = self.entries.get(k)
+        if old is not None and old[0] <= entry[0]:
+            return
+        self.entries[k] = entry
+        heapq.heappush(self.heap, entry)
+
+    def pop(self):
+        """Pop and return the item (with min or max f(x) value)
+        depending on the order."""
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            k = self.key(entry[-1])
+            if self.entries.get(k) is entry:
+                del self.entries[k]
+                return entry[-1]
+        raise Exception('Trying to pop from empty PriorityQueue.')
+
+    def __len__(self):
+        """Return current capacity of PriorityQueue."""
+        return len(self.entries)
+
+    def __contains__(self, key):
+        """Return True if the key is in PriorityQueue."""
+        return self.key(key) in self.entries
+
+    def __getitem__(self, key):
+        """Returns the value associated with key in PriorityQueue.
+        Raises KeyError if key is not present."""
+        try:
+            return self.entries[self.key(key)][0]
+        except KeyError:
+            raise KeyError(str(key) + " is not in the priority queue")
+
+    def __delitem__(self, key):
+        """Delete key, leaving a tombstone in the heap. The heap is rebuilt
+        from the live entries once tombstones outnumber them."""
+        try:
+            del self.entries[self.key(key)]
+        except KeyError:
+            raise KeyError(str(key) + " is not in the priority queue")
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = list(self.entries.values())
+            heapq.heapify(self.heap)
+
+
+class BucketQueue:
+    """A drop-in IndexedPriorityQueue for small non-negative integer f(x),
+    e.g. f = g + h with unit step costs: a list of buckets, one per f
+    value, each a LIFO stack, so append and pop are O(1) instead of
+    heap operations. Only order 'min' is supported, and tie is accepted
+    for compatibility but unused (the LIFO order already decides ties).
+    Like IndexedPriorityQueue it keeps one entry per key(item), with
+    tombstones for deleted or replaced entries."""
+
+    def __init__(self, order='min', f=lambda x: x, key=lambda x: x, tie=None):
+        if order != 'min':
+            raise ValueError("BucketQueue order must be 'min'.")
+        self.f = f
+        self.key = key
+        self.buckets = []
+        self.entries = {}
+        self.lowest = 0  # no live entry is in a bucket below this one
+
+    def append(self, item):
+        """Push item on the bucket of its f(x), unless its key is already
+        queued with a better or equal f(x)."""
+        value = self.f(item)
+        if value != int(value) or value < 0:
+            raise ValueError('BucketQueue needs non-negative integer f(x), got ' + str(value))
+        value = int(value)
+        k = self.key(item)
+        old = self.entries.get(k)
+        if old is not None and old[0] <= value:
+            return
+        entry = (value, item)
+        self.entries[k] = entry
+        while len(self.buckets) <= value:
+            self.buckets.append([])
+        self.buckets[value].append(entry)
+        self.lowest = min(self.lowest, value)
+
+    def extend(self, items):
+        """Insert each item in items at its correct position."""
+        for item in items:
+            self.append(item)
+
+    def pop(self):
+        """Pop and return the item with min f(x), the last one pushed
+        among equals."""
+        while self.lowest < len(self.buckets):
+            bucket = self.buckets[self.lowest]
+            while bucket:
+                entry = bucket.pop()
+                k = self.key(entry[1])
+                if self.entries.get(k) is entry:
+                    del self.entries[k]
+                    return entry[1]
+            self.lowest += 1
+        raise Exception('Trying to pop from empty BucketQueue.')
+
+    def __len__(self):
+        """Return current capacity of BucketQueue."""
+        return len(self.entries)
+
+    def __contains__(self, key):
+        """Return True if the key is in BucketQueue."""
+        return self.key(key) in self.entries
+
+    def __getitem__(self, key):
+        """Returns the value associated with key in BucketQueue.
+        Raises KeyError if key is not present."""
+        try:
+            return self.entries[self.key(key)][0]
+        except KeyError:
+            raise KeyError(str(key) + " is not in the priority queue")
+
+    def __delitem__(self, key):
+        """Delete key, leaving a tombstone in its bucket."""
+        try:
+            del self.entries[self.key(key)]
+        except KeyError:
+            raise KeyError(str(key) + " is not in the priority queue")
+
+
+# ______________________________________________________________________________
+# Explored sets
+
+
+def state_digest(state, size=8):
+    """Return a size bytes blake2b digest of a state, as an int: of the
+    state itself if it is bytes, of its bytes if it is a non-negative int
+    and of its repr otherwise."""
+    if isinstance(state, int):
+        state = state.to_bytes(state.bit_length() // 8 + 1, 'little')
+    elif not isinstance(state, (bytes, bytearray)):
+        state = repr(state).encode()
+    return int.from_bytes(hashlib.blake2b(state, digest_size=size).digest(), 'little')
+
+
+class FingerprintSet:
+    """A set of states for the explored (or reached) set of the graph
+    searches, that only keeps a 64-bit fingerprint of each state
+    (state_digest) in a numpy open-addressing table with linear probing.
+    0 marks an empty slot, so a fingerprint of 0 is stored as 1. The table
+    doubles once it is half full, so it takes 16 to 32 bytes per state,
+    instead of the state itself plus the overhead of a set entry.
+
+    Two different states with the same fingerprint are taken for the same
+    one, so the second one is never searched. With n states the chance
+    that any two of them collide is below n * n / 2**65, e.g. 3e-4 for
+    10**8 states. With verify the states are also kept, in an object array
+    beside the table, and compared on a fingerprint match: membership is
+    then exact, but the memory saving is lost."""
+
+    def __init__(self, capacity=1024, verify=False):
+        size = 1
+        while size < 2 * capacity:
+            size *= 2
+        self.table = np.zeros(size, dtype=np.uint64)
+        self.states = np.empty(size, dtype=object) if verify else None
+        self.count = 0
+
+    def _find(self, state):
+        """Return the slot of state, or the empty slot where it belongs,
+        and its fingerprint."""
+        fingerprint = state_digest(state) or 1
+        table = self.table
+        mask = len(table) - 1
+        slot = fingerprint & mask
+        while True:
+            entry = int(table[slot])
+            if entry == 0:
+                return slot, fingerprint
+            if entry == fingerprint and (self.states is None or self.states[slot] == state):
+                return slot, fingerprint
+            slot = (slot + 1) & mask
+
+    def __contains__(self, state):
+        return int(self.table[self._find(state)[0]]) != 0
+
+    def add(self, state):
+        slot, fingerprint = self._find(state)
+        if int(self.table[slot]) == 0:
+            self.table[slot] = fingerprint
+            if self.states is not None:
+                self.states[slot] = state
+            self.count += 1
+            if 2 * self.count > len(self.table):
+                self._grow()
+
+    def _grow(self):
+        """Double the table, placing all the fingerprints again at once:
+        each round the ones whose next probe slot is empty take it, the
+        first one of each slot winning, and the others probe on."""
+        used = np.nonzero(self.table)[0]
+        fingerprints = self.table[used]
+        states = None if self.states is None else self.states[used]
+        table = np.zeros(2 * len(self.table), dtype=np.uint64)
+        mask = np.uint64(len(table) - 1)
+        slots = fingerprints & mask
+        pending = np.arange(len(fingerprints))
+        new_states = None if states is None else np.empty(len(table), dtype=object)
+        while len(pending):
+            free = table[slots[pending]] == 0
+            placed, first = np.unique(slots[pending[free]], return_index=True)
+            chosen = pending[free][first]
+            table[placed] = fingerprints[chosen]
+            if new_states is not None:
+                new_states[placed] = states[chosen]
+            done = np.zeros(len(fingerprints), dtype=bool)
+            done[chosen] = True
+            pending = pending[~done[pending]]
+            slots[pending] = (slots[pending] + np.uint64(1)) & mask
+        self.table = table
+        self.states = new_states
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        """The bytes taken by the table (and the array of states)."""
+        return self.table.nbytes + (0 if self.states is None else self.states.nbytes)
+
+
+class BloomFilter:
+    """Bitstate hashing: an approximate set of states for the explored (or
+    reached) set of the graph searches, in a numpy bit array of nbytes
+    bytes whatever the number of states. Each state sets hashes bits,
+    picked by double hashing of its 128-bit state_digest.
+
+    A state whose bits were all set by others is taken for explored
+    (a false positive) and never searched, so a search may miss a
+    solution, or return a longer one, but covers far more states in the
+    same memory. report() gives the fill ratio of the bits and the
+    estimated false positive rate, fill ** hashes."""
+
+    def __init__(self, nbytes, hashes=3):
+        self.bits = np.zeros(nbytes, dtype=np.uint8)
+        self.size = 8 * nbytes
+        self.hashes = hashes
+        self.count = 0
+        self.set_bits = 0
+
+    def _positions(self, state):
+        digest = state_digest(state, 16)
+        step = (digest >> 64) | 1
+        return [(digest + i * step) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, state):
+        bits = self.bits
+        return all(bits[n >> 3] & (1 << (n & 7)) for n in self._positions(state))
+
+    def add(self, state):
+        bits = self.bits
+        new = 0
+        for n in self._positions(state):
+            mask = 1 << (n & 7)
+            if not bits[n >> 3] & mask:
+                bits[n >> 3] |= mask
+                new += 1
+        if new:
+            self.count += 1
+            self.set_bits += new
+
+    def __len__(self):
+        """The number of states added, as far as the filter can tell."""
+        return self.count
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def fill_ratio(self):
+        """The fraction of the bits that are set."""
+        return self.set_bits / self.size
+
+    def false_positive_rate(self):
+        """The estimated chance that a state never added is taken for one."""
+        return self.fill_ratio() ** self.hashes
+
+    def report(self):
+        return {'states': self.count, 'bytes': self.nbytes, 'hashes': self.hashes,
+                'fill_ratio': self.fill_ratio(), 'false_positive_rate': self.false_positive_rate()}
+
+
 # ______________________________________________________________________________
 # Useful Shorthands
 
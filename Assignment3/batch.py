@@ -0,0 +1,168 @@
+"""
+Solve many RTB puzzles in parallel, one worker process per puzzle.
+
+    python batch.py public_tests --jobs 8 --timeout 60 --max-nodes 1000000 --cache solved.sqlite
+
+Takes directories (all their .dat files), glob patterns or files. Each
+puzzle is solved with RTBProblem's algorithm under a wall-clock and a
+generated nodes budget, and one JSON line is printed per puzzle as soon as
+it finishes:
+
+    {"puzzle": ..., "status": ..., "cost": ..., "moves": ..., "nodes": ..., "seconds": ...}
+
+status is one of solved, unsolvable, node-budget, timeout or error. With
+--cache, boards already in the SolutionCache file are answered from it
+(with 0 nodes) and the new answers are added to it.
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import time
+
+import search
+import solution
+
+
+class NodeBudgetExceeded(Exception):
+    """The search generated more nodes than it was allowed to."""
+
+
+class BudgetedProblem(search.InstrumentedProblem):
+    """Counts generated nodes, like InstrumentedProblem, and stops the
+    search once max_nodes of them were generated (0 for no limit)."""
+
+    def __init__(self, problem, max_nodes=0):
+        super().__init__(problem)
+        self.max_nodes = max_nodes
+
+    def result(self, state, action):
+        if self.max_nodes and self.states >= self.max_nodes:
+            raise NodeBudgetExceeded
+        return super().result(state, action)
+
+
+def puzzle_paths(patterns):
+    """Expand directories and glob patterns into a sorted list of puzzle files."""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(sorted(glob.glob(os.path.join(pattern, "*.dat"))))
+        else:
+            paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    return paths
+
+
+def solve_puzzle(path, max_nodes=0, open_list="heap", cache=None):
+    """Solve one puzzle file and return its JSON record."""
+    started = time.perf_counter()
+    record = {"puzzle": path, "status": None, "cost": None, "moves": None, "nodes": None}
+    problem = BudgetedProblem(solution.RTBProblem(), max_nodes)
+    try:
+        with open(path) as fh:
+            problem.problem.load(fh)
+        problem.problem.setAlgorithm(open_list)
+        if cache is not None:
+            problem.problem.setCache(cache)
+        node = problem.problem.solve(problem)
+        if node is None:
+            record["status"] = "unsolvable"
+        else:
+            record.update(status="solved", cost=node.path_cost, moves=node.solution())
+    except NodeBudgetExceeded:
+        record["status"] = "node-budget"
+    except Exception as error:
+        record.update(status="error", error=repr(error))
+    record["nodes"] = problem.states
+    record["seconds"] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def _worker(path, max_nodes, open_list, cache, conn):
+    conn.send(solve_puzzle(path, max_nodes, open_list, cache))
+    conn.close()
+
+
+def _stop(process):
+    """Terminate a worker, and kill it if it does not exit promptly."""
+    process.terminate()
+    process.join(1)
+    if process.is_alive():
+        process.kill()
+        process.join()
+
+
+def run(paths, jobs=None, timeout=None, max_nodes=0, open_list="heap", cache=None, out=sys.stdout):
+    """
+    Solve the puzzle files in paths with up to jobs worker processes and
+    write one JSON line per puzzle to out as each one finishes. Workers
+    still running timeout seconds after they started are killed and
+    reported as timeout. cache is the path of a SolutionCache file shared by
+    the workers. Returns the list of records, in finishing order.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    pending = list(reversed(paths))
+    running = {}  # result connection -> (process, path, start time)
+    records = []
+
+    def emit(record):
+        records.append(record)
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+
+    while pending or running:
+        while pending and len(running) < jobs:
+            path = pending.pop()
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=_worker, args=(path, max_nodes, open_list, cache, sender), daemon=True
+            )
+            process.start()
+            sender.close()
+            running[receiver] = (process, path, time.monotonic())
+
+        wait = None
+        if timeout is not None:
+            oldest = min(started for _, _, started in running.values())
+            wait = max(0.0, oldest + timeout - time.monotonic())
+        for receiver in multiprocessing.connection.wait(list(running), wait):
+            process, path, started = running.pop(receiver)
+            try:
+                emit(receiver.recv())
+            except EOFError:
+                # the worker died before sending its record
+                emit({"puzzle": path, "status": "error", "cost": None, "moves": None,
+                      "nodes": None, "seconds": round(time.monotonic() - started, 3),
+                      "error": "worker exit code {}".format(process.exitcode)})
+            receiver.close()
+            process.join()
+
+        if timeout is not None:
+            now = time.monotonic()
+            for receiver, (process, path, started) in list(running.items()):
+                if now - started >= timeout:
+                    _stop(process)
+                    receiver.close()
+                    del running[receiver]
+                    emit({"puzzle": path, "status": "timeout", "cost": None, "moves": None,
+                          "nodes": None, "seconds": round(now - started, 3)})
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve RTB puzzles in parallel.")
+    parser.add_argument("puzzles", nargs="+", help="puzzle files, directories or glob patterns")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--timeout", type=float, default=None, help="wall-clock seconds per puzzle")
+    parser.add_argument("--max-nodes", type=int, default=0, help="generated nodes per puzzle (0: no limit)")
+    parser.add_argument("--open-list", choices=("heap", "bucket"), default="heap")
+    parser.add_argument("--cache", default=None, help="SolutionCache file to answer from and fill")
+    args = parser.parse_args(argv)
+    run(puzzle_paths(args.puzzles), args.jobs, args.timeout, args.max_nodes, args.open_list, args.cache)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+A persistent cache of solved boards, in an SQLite file.
+
+Entries are keyed by RTBProblem.cache_key(), a hash of the board size and
+its tiles, and keep the actions of the solution found and its cost, or
+that the board has no solution. Every lookup marks the entry as recently
+used and, once the cache holds more than max_entries boards, the least
+recently used ones are evicted.
+"""
+import json
+import sqlite3
+import time
+from typing import NamedTuple, Optional, Tuple
+
+
+class CachedSolution(NamedTuple):
+    """
+    A cache entry. actions is None for a board without solution, and
+    optimal tells if the search that solved it guarantees the lowest cost.
+    """
+
+    actions: Optional[Tuple]
+    cost: Optional[int]
+    optimal: bool
+
+
+class SolutionCache:
+    def __init__(self, path: str, max_entries: int = 100000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path)
+        # no fsync per lookup: a crash may only lose the latest entries
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS solutions ("
+            " key TEXT PRIMARY KEY, actions TEXT, cost INTEGER,"
+            " optimal INTEGER NOT NULL, used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS solutions_used ON solutions (used)")
+        self.db.commit()
+
+    def get(self, key: str, optimal: bool = False) -> Optional[CachedSolution]:
+        """
+        Return the entry of key, or None if there is none. With optimal, an
+        entry from a search without that guarantee is treated as missing.
+        """
+        row = self.db.execute(
+            "SELECT actions, cost, optimal FROM solutions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (optimal and not row[2]):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.execute("UPDATE solutions SET used = ? WHERE key = ?", (time.time(), key))
+        self.db.commit()
+        actions = None if row[0] is None else tuple(
+            tuple(tuple(loc) for loc in action) for action in json.loads(row[0])
+        )
+        return CachedSolution(actions, row[1], bool(row[2]))
+
+    def put(self, key: str, node, optimal: bool):
+        """
+        Store the goal node a search returned for key (None for a board
+        without solution). An optimal entry is never replaced by one that
+        is not. A 'cutoff' result says nothing about the board and is not
+        stored.
+        """
+        if node == "cutoff":
+            return
+        if not optimal:
+            row = self.db.execute("SELECT optimal FROM solutions WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0]:
+                return
+        actions, cost = (None, None) if node is None else (json.dumps(node.solution()), node.path_cost)
+        self.db.execute(
+            "INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?, ?)",
+            (key, actions, cost, int(optimal), time.time()),
+        )
+        self.db.execute(
+            "DELETE FROM solutions WHERE key IN ("
+            " SELECT key FROM solutions ORDER BY used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        self.db.commit()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM solutions").fetchone()[0]
+
+    def close(self):
+        self.db.close()
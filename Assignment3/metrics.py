@@ -28,6 +28,8 @@ def report(searchers, problems, verbose=True):
         report_counts(total_counts, 'TOTAL\n')
         
 def report_counts(counts, name):
-    """Print one line of the counts report."""
+    """Print one line of the counts report. Node.expand asks a problem for
+    its actions through node_actions, so those calls count as actions."""
     print('{:9,d} nodes |{:9,d} goal |{:5.0f} cost |{:8,d} actions | {}'.format(
-          counts['result'], counts['is_goal'], counts['cost'], counts['actions'], name))
+          counts['result'], counts['is_goal'], counts['cost'],
+          counts['actions'] + counts['node_actions'], name))
@@ -0,0 +1,83 @@
+"""
+Pattern databases for RTBProblem.h_pdb.
+
+A pattern is a region of movable cells around a target cell, that must
+hold a tile of some types in every goal state. Its abstract states only
+tell, for each cell of the region, whether it holds an empty-cell, a tile
+of the target types (MATCH) or any other tile, so there are 3**len(cells)
+of them, indexed by the base 3 number with one digit per cell.
+
+An empty-cell swaps with a neighboring tile of the region as in the real
+puzzle. Cells on the region boundary can also be swapped with the outside,
+whose contents are unknown: an empty one can take a tile of either class,
+and a tile can leave. Each real move is then an abstract move or leaves
+the abstract state as it is, so the abstract distance to a state with a
+MATCH tile in the target cell never overestimates the real one.
+"""
+import os
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+EMPTY, MATCH, OTHER = 0, 1, 2
+UNREACHABLE = 255
+
+_databases: Dict[str, np.ndarray] = {}
+
+
+def distances(
+    size: int, adjacent: Sequence[Tuple[int, int]], boundary: Sequence[int], target: int
+) -> np.ndarray:
+    """
+    Breadth-first search of the abstract space of a region of size cells,
+    from every state with MATCH in cell target. adjacent are the pairs of
+    neighboring cells of the region and boundary the cells next to the
+    outside. Every abstract move can be undone, so searching from the goal
+    states gives the distance to them. Returns the uint8 distance of each
+    state, UNREACHABLE if it has none.
+    """
+    count = 3 ** size
+    weight = 3 ** np.arange(size)
+    states = np.arange(count)
+    digits = states[:, None] // weight % 3
+    dist = np.full(count, UNREACHABLE, dtype=np.uint8)
+    frontier = states[digits[:, target] == MATCH]
+    dist[frontier] = 0
+    depth = 0
+    while len(frontier) and depth < UNREACHABLE - 1:
+        depth += 1
+        d = digits[frontier]
+        neighbors = [frontier[:0]]
+        for i, j in adjacent:
+            # the tile of one cell slides into the other, an empty-cell
+            swap = (d[:, i] == EMPTY) != (d[:, j] == EMPTY)
+            delta = (d[swap, j] - d[swap, i]) * (weight[i] - weight[j])
+            neighbors.append(frontier[swap] + delta)
+        for b in boundary:
+            empty = d[:, b] == EMPTY
+            neighbors.append(frontier[empty] + MATCH * weight[b])
+            neighbors.append(frontier[empty] + OTHER * weight[b])
+            neighbors.append(frontier[~empty] - d[~empty, b] * weight[b])
+        frontier = np.unique(np.concatenate(neighbors))
+        frontier = frontier[dist[frontier] == UNREACHABLE]
+        dist[frontier] = depth
+    return dist
+
+
+def load(
+    directory: str, key: str, size: int, adjacent: List[Tuple[int, int]], boundary: List[int], target: int
+) -> np.ndarray:
+    """
+    Return the database named key, memory-mapped from its .npy file in
+    directory, building and saving it first if there is none.
+    """
+    path = os.path.join(directory, key + ".npy")
+    if path not in _databases:
+        if not os.path.exists(path):
+            os.makedirs(directory, exist_ok=True)
+            # written aside and renamed, so concurrent solvers never read half a file
+            partial = "{}.{}.tmp.npy".format(path[:-4], os.getpid())
+            np.save(partial, distances(size, adjacent, boundary, target))
+            os.replace(partial, path)
+        _databases[path] = np.load(path, mmap_mode="r")
+    return _databases[path]
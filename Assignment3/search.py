@@ -6,9 +6,18 @@ then create problem instances and solve them with calls to the various search
 functions.
 """
 
+import heapq
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
 import sys
+import time
 from collections import deque
 
+import numpy as np
+
 from utils import *
 
 
@@ -48,6 +57,13 @@ class Problem:
         else:
             return state == self.goal
 
+    def goal_test_node(self, node):
+        """Return True if the node's state is a goal. The search algorithms
+        call this one, so a problem that keeps per-node data (e.g. work it
+        can reuse from node.parent) can override it; the default method
+        calls goal_test on the state."""
+        return self.goal_test(node.state)
+
     def path_cost(self, c, state1, action, state2):
         """Return the cost of a solution path that arrives at state2 from
         state1 via action, assuming cost c to get up to state1. If the problem
@@ -61,6 +77,18 @@ class Problem:
         and related algorithms try to maximize this value."""
         raise NotImplementedError
 
+    def inverse(self, action):
+        """Return the action that undoes action, so a search can skip it
+        right after action. The default method returns None, for problems
+        where it is not known."""
+        return None
+
+    def node_actions(self, node):
+        """Return the actions to expand node with. Node.expand calls this
+        one, so a problem can leave out actions that the path to node makes
+        useless; the default method returns actions(node.state)."""
+        return self.actions(node.state)
+
 
 # ______________________________________________________________________________
 
@@ -73,7 +101,15 @@ class Node:
     the total path_cost (also known as g) to reach the node. Other functions
     may add an f and h value; see best_first_graph_search and astar_search for
     an explanation of how the f and h values are handled. You will not need to
-    subclass this class."""
+    subclass this class.
+    Nodes use __slots__ instead of a __dict__, with the f and h fields
+    reserved (None until computed) and aux free for per-node data of the
+    problem. Each node also gets an increasing order number, used to break
+    ties between nodes with the same priority without comparing states."""
+
+    __slots__ = ('state', 'parent', 'action', 'path_cost', 'depth', 'f', 'h', 'aux', 'order')
+
+    _counter = itertools.count()
 
     def __init__(self, state, parent=None, action=None, path_cost=0):
         """Create a search tree Node, derived from a parent by an action."""
@@ -84,17 +120,24 @@ class Node:
         self.depth = 0
         if parent:
             self.depth = parent.depth + 1
+        self.f = self.h = self.aux = None
+        self.order = next(Node._counter)
+
+    @property
+    def g(self):
+        """The path cost to reach the node."""
+        return self.path_cost
 
     def __repr__(self):
         return "<Node {}>".format(self.state)
 
     def __lt__(self, node):
-        return self.state < node.state
+        return self.order < node.order
 
     def expand(self, problem):
         """List the nodes reachable in one step from this node."""
         return [self.child_node(problem, action)
-                for action in problem.actions(self.state)]
+                for action in problem.node_actions(self)]
 
     def child_node(self, problem, action):
         """[Figure 3.10]"""
@@ -188,7 +231,7 @@ def breadth_first_tree_search(problem):
 
     while frontier:
         node = frontier.popleft()
-        if problem.goal_test(node.state):
+        if problem.goal_test_node(node):
             return node
         frontier.extend(node.expand(problem))
     return None
@@ -207,13 +250,13 @@ def depth_first_tree_search(problem):
 
     while frontier:
         node = frontier.pop()
-        if problem.goal_test(node.state):
+        if problem.goal_test_node(node):
             return node
         frontier.extend(node.expand(problem))
     return None
 
 
-def depth_first_graph_search(problem):
+def depth_first_graph_search(problem, explored=None):
     """
     [Figure 3.7]
     Search the deepest nodes in the search tree first.
@@ -221,58 +264,80 @@ def depth_first_graph_search(problem):
     The argument frontier should be an empty queue.
     Does not get trapped by loops.
     If two paths reach a state, only use the first one.
+    The reached set holds the states explored or in the frontier, so a
+    state is checked against both with one hash lookup. explored is an
+    empty set-like object to use for it instead of a set, e.g. a
+    utils.FingerprintSet.
     """
-    frontier = [(Node(problem.initial))]  # Stack
+    node = Node(problem.initial)
+    frontier = [node]  # Stack
 
-    explored = set()
+    reached = set() if explored is None else explored
+    reached.add(node.state)
     while frontier:
         node = frontier.pop()
-        if problem.goal_test(node.state):
+        if problem.goal_test_node(node):
             return node
-        explored.add(node.state)
-        frontier.extend(child for child in node.expand(problem)
-                        if child.state not in explored and child not in frontier)
+        for child in node.expand(problem):
+            if child.state not in reached:
+                reached.add(child.state)
+                frontier.append(child)
     return None
 
 
-def breadth_first_graph_search(problem):
+def breadth_first_graph_search(problem, explored=None):
     """[Figure 3.11]
     Note that this function can be implemented in a
     single line as below:
     return graph_search(problem, FIFOQueue())
+    The reached set holds the states explored or in the frontier, so a
+    child is checked against both with one hash lookup. explored is an
+    empty set-like object to use for it instead of a set, e.g. a
+    utils.FingerprintSet.
     """
     node = Node(problem.initial)
-    if problem.goal_test(node.state):
+    if problem.goal_test_node(node):
         return node
     frontier = deque([node])
-    explored = set()
+    reached = set() if explored is None else explored
+    reached.add(node.state)
     while frontier:
         node = frontier.popleft()
-        explored.add(node.state)
         for child in node.expand(problem):
-            if child.state not in explored and child not in frontier:
-                if problem.goal_test(child.state):
+            if child.state not in reached:
+                if problem.goal_test_node(child):
                     return child
+                reached.add(child.state)
                 frontier.append(child)
     return None
 
 
-def best_first_graph_search(problem, f, display=False):
+def best_first_graph_search(problem, f, display=False, prefer_deeper=False,
+                            frontier_factory=IndexedPriorityQueue, explored=None, tie=None):
     """Search the nodes with the lowest f scores first.
     You specify the function f(node) that you want to minimize; for example,
     if f is a heuristic estimate to the goal, then we have greedy best
     first search; if f is node.depth then we have breadth-first search.
     There is a subtlety: the line "f = memoize(f, 'f')" means that the f
     values will be cached on the nodes as they are computed. So after doing
-    a best first search you can examine the f values of the path returned."""
+    a best first search you can examine the f values of the path returned.
+    Nodes with the same f are taken oldest first, or deepest first if
+    prefer_deeper is set, or in the order of tie(node) if given.
+    frontier_factory is the class of the frontier, e.g. BucketQueue when f
+    only takes small integer values. explored is an
+    empty set-like object for the explored states, a set by default, e.g.
+    a utils.FingerprintSet."""
     f = memoize(f, 'f')
     node = Node(problem.initial)
-    frontier = PriorityQueue('min', f)
+    if tie is None and prefer_deeper:
+        tie = lambda node: -node.depth
+    frontier = frontier_factory('min', f, key=lambda node: node.state, tie=tie)
     frontier.append(node)
-    explored = set()
+    if explored is None:
+        explored = set()
     while frontier:
         node = frontier.pop()
-        if problem.goal_test(node.state):
+        if problem.goal_test_node(node):
             if display:
                 print(len(explored), "paths have been expanded and", len(frontier), "paths remain in the frontier")
             return node
@@ -287,16 +352,18 @@ def best_first_graph_search(problem, f, display=False):
     return None
 
 
-def uniform_cost_search(problem, display=False):
+def uniform_cost_search(problem, display=False, prefer_deeper=False, frontier_factory=IndexedPriorityQueue,
+                        explored=None):
     """[Figure 3.14]"""
-    return best_first_graph_search(problem, lambda node: node.path_cost, display)
+    return best_first_graph_search(problem, lambda node: node.path_cost, display, prefer_deeper, frontier_factory,
+                                   explored)
 
 
 def depth_limited_search(problem, limit=50):
     """[Figure 3.17]"""
 
     def recursive_dls(node, problem, limit):
-        if problem.goal_test(node.state):
+        if problem.goal_test_node(node):
             return node
         elif limit == 0:
             return 'cutoff'
@@ -406,18 +473,38 @@ def bidirectional_search(problem):
 # Informed (Heuristic) Search
 
 
-greedy_best_first_graph_search = best_first_graph_search
+def _node_heuristic(problem, h, h_cache):
+    """h, or else problem.h, with its values kept on the nodes and, given
+    an h_cache (utils.HeuristicCache), by state across nodes."""
+    h = h or problem.h
+    if h_cache is not None:
+        h = h_cache.wrap(h)
+    return memoize(h, 'h')
 
 
-# Greedy best-first search is accomplished by specifying f(n) = h(n).
+def greedy_best_first_graph_search(problem, h=None, display=False, prefer_deeper=False,
+                                   frontier_factory=IndexedPriorityQueue, h_cache=None):
+    """Greedy best-first search is accomplished by specifying f(n) = h(n)."""
+    return best_first_graph_search(problem, _node_heuristic(problem, h, h_cache), display, prefer_deeper,
+                                   frontier_factory)
 
 
-def astar_search(problem, h=None, display=False):
+def astar_search(problem, h=None, display=False, prefer_deeper=False, frontier_factory=IndexedPriorityQueue,
+                 h_cache=None, explored=None):
     """A* search is best-first graph search with f(n) = g(n)+h(n).
     You need to specify the h function when you call astar_search, or
-    else in your Problem subclass."""
-    h = memoize(h or problem.h, 'h')
-    return best_first_graph_search(problem, lambda n: n.path_cost + h(n), display)
+    else in your Problem subclass. h_cache is an optional
+    utils.HeuristicCache, that may be shared with later searches.
+    Among nodes with the same f, goals go first, then the deepest if
+    prefer_deeper: a goal with the lowest f is a cheapest one, and is
+    returned without expanding the other nodes with that f."""
+    h = _node_heuristic(problem, h, h_cache)
+
+    def tie(n):
+        return not problem.goal_test_node(n), -n.depth if prefer_deeper else 0
+
+    return best_first_graph_search(problem, lambda n: n.path_cost + h(n), display, prefer_deeper,
+                                   frontier_factory, explored, tie)
 
 
 # ______________________________________________________________________________
@@ -600,12 +687,15 @@ class PlanRoute(Problem):
 # Other search algorithms
 
 
-def recursive_best_first_search(problem, h=None):
-    """[Figure 3.26]"""
-    h = memoize(h or problem.h, 'h')
+def recursive_best_first_search(problem, h=None, h_cache=None):
+    """[Figure 3.26]
+    RBFS forgets the subtrees it backs up from and expands them again
+    later, so an h_cache (utils.HeuristicCache) spares evaluating h again
+    on their states."""
+    h = _node_heuristic(problem, h, h_cache)
 
     def RBFS(problem, node, flimit):
-        if problem.goal_test(node.state):
+        if problem.goal_test_node(node):
             return node, 0  # (The second value is immaterial)
         successors = node.expand(problem)
         if len(successors) == 0:
@@ -632,6 +722,566 @@ def recursive_best_first_search(problem, h=None):
     return result
 
 
+def ida_star_search(problem, h=None, tt_size=1 << 20):
+    """Iterative deepening A*: depth-first searches that prune nodes with
+    f = g + h above a bound, raised each time to the lowest f that was
+    pruned. Memory is linear in the solution depth, plus a transposition
+    table of at most tt_size states (0 disables it) with the lowest g each
+    state was reached with in the current iteration: a state reached again
+    with a g that is not lower is skipped, before its f is compared with
+    the bound, as its subtree was already searched with more budget. So
+    it does not raise the next bound, and neither does a state pruned in
+    an iteration that also expanded it with a lower g, as long as the
+    states expanded and pruned fit in tt_size. The search then ends on a
+    problem without solution once the table holds every state it can
+    reach. Once the table is full only the states already in it are
+    updated. The move that undoes the action of a node
+    (problem.inverse) is never generated."""
+    h = memoize(h or problem.h, 'h')
+
+    def DFS(node, bound, table, pruned):
+        if tt_size:
+            g = table.get(node.state)
+            if g is not None and g <= node.path_cost:
+                return None, np.inf
+        f = node.path_cost + h(node)
+        if f > bound:
+            if tt_size and (node.state in pruned or len(pruned) < tt_size):
+                pruned[node.state] = min(f, pruned.get(node.state, np.inf))
+            return None, f
+        if problem.goal_test_node(node):
+            return node, f
+        if tt_size:
+            if g is not None or len(table) < tt_size:
+                table[node.state] = node.path_cost
+        undo = problem.inverse(node.action) if node.parent else None
+        next_bound = np.inf
+        for action in problem.node_actions(node):
+            if undo is not None and action == undo:
+                continue
+            result, f = DFS(node.child_node(problem, action), bound, table, pruned)
+            if result is not None:
+                return result, f
+            next_bound = min(next_bound, f)
+        return None, next_bound
+
+    node = Node(problem.initial)
+    bound = h(node)
+    while bound < np.inf:
+        table, pruned = {}, {}
+        result, bound = DFS(node, bound, table, pruned)
+        if result is not None:
+            return result
+        if len(table) < tt_size and len(pruned) < tt_size:
+            # no state was left out of table or pruned: the bound is only
+            # raised by the states that were never expanded
+            bound = min((f for state, f in pruned.items() if state not in table), default=np.inf)
+    return None
+
+
+class _SMARecord:
+    """The bookkeeping of a node in memory, for sma_star_search: its
+    children in memory and the f of those it forgot, by action, whether
+    it was expanded, and the order numbers of its latest entries in the
+    frontier and leaf heaps (the older ones are stale)."""
+
+    __slots__ = ('node', 'parent', 'children', 'forgotten', 'expanded', 'alive', 'in_best', 'in_worst')
+
+    def __init__(self, node, parent=None):
+        self.node = node
+        self.parent = parent
+        self.children = {}
+        self.forgotten = {}
+        self.expanded = False
+        self.alive = True
+        self.in_best = None
+        self.in_worst = None
+
+
+def sma_star_search(problem, h=None, max_nodes=1 << 20, max_bytes=None, h_cache=None):
+    """Simplified memory-bounded A*: A* on the search tree that keeps at
+    most max_nodes nodes in memory, or as many as fit in max_bytes,
+    estimated from the size of the root node and its state. Once memory is
+    full, the leaf with the highest f (shallowest first) is dropped and its
+    f kept in its parent, which gets back in the frontier to generate that
+    child again, one forgotten child at a time, when it is the best one.
+    The f of an expanded node is the lowest f of its children, in memory
+    or forgotten, and a child's f is never lower than its parent's. A node
+    at depth max_nodes - 1 that is not a goal gets f = inf, as its path
+    cannot fit, and if the search runs out of nodes with a finite f after
+    that, it returns 'cutoff' instead of None: the problem may still have
+    a solution, longer than fits in memory. A child whose state is already in memory with a path that
+    is not longer is left out, as that node stands for it, and so are
+    cycles. Goals are tested as they are generated, and one that costs no
+    more than the f of its parent, the lowest f in the frontier, is
+    returned. Returns a cheapest solution whenever one fits in memory.
+    Stale heap entries are dropped once they outnumber the live ones, so
+    the heaps stay within a few entries per node in memory."""
+    h = _node_heuristic(problem, h, h_cache)
+    root = _SMARecord(Node(problem.initial))
+    if max_bytes is not None:
+        # up to 2 entries per node in each heap, as they are compacted
+        entry = sys.getsizeof((0.0, 0, 1 << 40, root)) + sys.getsizeof(1 << 40) + sys.getsizeof(0.0) + 8
+        size = (sys.getsizeof(root.node) + sys.getsizeof(root.node.state) + sys.getsizeof(root)
+                + 2 * sys.getsizeof(root.children) + 4 * entry)
+        max_nodes = min(max_nodes, max_bytes // size)
+    root.node.f = h(root.node)
+    order = itertools.count()
+    # the frontier, lowest f and deepest first, and the leaves, highest f and shallowest first
+    best = []
+    worst = []
+    # the cheapest node in memory of each state
+    in_memory = {root.node.state: root}
+    count = 1
+    cutoff_occurred = False
+
+    def push_best(f, rank, record):
+        record.in_best = next(order)
+        heapq.heappush(best, (f, rank, record.in_best, record))
+
+    def push_worst(f, depth, record):
+        record.in_worst = next(order)
+        heapq.heappush(worst, (-f, depth, record.in_worst, record))
+
+    def compact(heap, latest):
+        heap[:] = [entry for entry in heap if entry[3].alive and entry[2] == latest(entry[3])]
+        heapq.heapify(heap)
+
+    push_best(root.node.f, 0, root)
+
+    def key(record):
+        if not record.expanded:
+            return record.node.f
+        return min(record.forgotten.values(), default=np.inf)
+
+    def backup(record):
+        while record is not None and record.expanded:
+            f = min([child.node.f for child in record.children.values()] + list(record.forgotten.values()),
+                    default=np.inf)
+            if f == record.node.f:
+                break
+            record.node.f = f
+            if not record.children:
+                push_worst(f, record.node.depth, record)
+            record = record.parent
+
+    while best:
+        f, _, n, record = heapq.heappop(best)
+        if not record.alive or n != record.in_best or f != key(record):
+            continue
+        record.in_best = None
+        if f == np.inf:
+            return 'cutoff' if cutoff_occurred else None
+        node = record.node
+        if record.expanded:
+            action = min(record.forgotten, key=record.forgotten.get)
+            actions = [action]
+            known = {action: record.forgotten.pop(action)}
+        else:
+            if problem.goal_test_node(node):
+                return node
+            actions = problem.node_actions(node)
+            known = {}
+        for action in actions:
+            child = node.child_node(problem, action)
+            other = in_memory.get(child.state)
+            if other is not None and other.node.path_cost <= child.path_cost:
+                continue
+            rank = -child.depth
+            if problem.goal_test_node(child):
+                if child.path_cost <= f:
+                    # f is the lowest cost any solution can still have
+                    return child
+                # taken before the other nodes with the same f
+                child.f, rank = child.path_cost, -np.inf
+            elif child.depth >= max_nodes - 1:
+                child.f = np.inf
+                cutoff_occurred = True
+            else:
+                child.f = max(child.path_cost + h(child), node.f, known.get(action, 0))
+            record.children[action] = in_memory[child.state] = leaf = _SMARecord(child, record)
+            count += 1
+            push_best(child.f, rank, leaf)
+            push_worst(child.f, child.depth, leaf)
+        record.expanded = True
+        if record.forgotten:
+            push_best(key(record), -node.depth, record)
+        backup(record)
+
+        while count > max_nodes and worst:
+            f, _, n, leaf = heapq.heappop(worst)
+            if not leaf.alive or n != leaf.in_worst or leaf.children or leaf is root or -f != leaf.node.f:
+                continue
+            leaf.alive = False
+            count -= 1
+            if in_memory.get(leaf.node.state) is leaf:
+                del in_memory[leaf.node.state]
+            parent = leaf.parent
+            del parent.children[leaf.node.action]
+            parent.forgotten[leaf.node.action] = leaf.node.f
+            # its stale heap entries must not keep the node, and the path above it, alive
+            leaf.node = leaf.parent = None
+            push_best(key(parent), -parent.node.depth, parent)
+            if not parent.children:
+                push_worst(parent.node.f, parent.node.depth, parent)
+        if len(best) > 2 * count + 64:
+            compact(best, lambda record: record.in_best)
+        if len(worst) > 2 * count + 64:
+            compact(worst, lambda record: record.in_worst)
+    return 'cutoff' if cutoff_occurred else None
+
+
+# ______________________________________________________________________________
+# Batched search
+# For problems with the batch methods of RTBProblem: to_array, expand_batch,
+# action_from_code, goal_test_batch and h_batch. Boards are the rows of a 2d
+# uint8 array and every move costs 1.
+
+
+def _board_keys(boards):
+    """The bytes of each row of boards, to keep in sets and dicts."""
+    boards = np.ascontiguousarray(boards)
+    return boards.view(np.dtype((np.void, boards.shape[1]))).ravel().tolist()
+
+
+def _grow(array, size):
+    """Return array, or a copy with room for at least size rows."""
+    if size <= len(array):
+        return array
+    grown = np.empty((max(size, 2 * len(array)),) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def batched_breadth_first_search(problem):
+    """Breadth-first graph search that expands a whole layer at a time:
+    the children of every node of the layer are generated, goal tested and
+    checked against the explored boards with array operations, instead of
+    calling actions and result once per node."""
+    layer = problem.to_array([problem.initial])
+    if problem.goal_test_batch(layer)[0]:
+        return Node(problem.initial)
+    explored = set(_board_keys(layer))
+    history = []  # the parents and move codes of each layer
+    while len(layer):
+        children, parents, codes = problem.expand_batch(layer)
+        keep = []
+        for i, key in enumerate(_board_keys(children)):
+            if key not in explored:
+                explored.add(key)
+                keep.append(i)
+        layer = children[keep]
+        history.append((parents[keep], codes[keep]))
+        goals = np.flatnonzero(problem.goal_test_batch(layer))
+        if len(goals):
+            i, moves = goals[0], []
+            for parents, codes in reversed(history):
+                moves.append(codes[i])
+                i = parents[i]
+            return replay(problem, [problem.action_from_code(code) for code in reversed(moves)])
+    return None
+
+
+def batched_astar_search(problem):
+    """A* search that pops every node with the lowest f at once, goal tests
+    and expands them together, and evaluates problem.h_batch on all their
+    children in one call. A board reached again with a lower g is
+    reopened."""
+    boards = problem.to_array([problem.initial])
+    parent = np.full(1, -1, dtype=np.intp)
+    code = np.full(1, -1, dtype=np.intp)
+    g = np.zeros(1, dtype=np.intp)
+    keys = _board_keys(boards)
+    best_g = {keys[0]: 0}
+    frontier = [(problem.h_batch(boards)[0], 0)]
+    size = 1
+    while frontier:
+        f = frontier[0][0]
+        batch = []
+        while frontier and frontier[0][0] == f:
+            i = heapq.heappop(frontier)[1]
+            if g[i] == best_g[keys[i]]:
+                batch.append(i)
+        if not batch:
+            continue
+        batch = np.array(batch, dtype=np.intp)
+        goals = np.flatnonzero(problem.goal_test_batch(boards[batch]))
+        if len(goals):
+            i, moves = batch[goals[0]], []
+            while parent[i] >= 0:
+                moves.append(code[i])
+                i = parent[i]
+            return replay(problem, [problem.action_from_code(c) for c in reversed(moves)])
+
+        children, parents, codes = problem.expand_batch(boards[batch])
+        child_g = g[batch][parents] + 1
+        keep = []
+        child_keys = _board_keys(children)
+        for j, key in enumerate(child_keys):
+            old = best_g.get(key)
+            if old is None or child_g[j] < old:
+                best_g[key] = child_g[j]
+                keep.append(j)
+        if not keep:
+            continue
+        new = slice(size, size + len(keep))
+        boards, parent, code, g = (_grow(a, new.stop) for a in (boards, parent, code, g))
+        boards[new] = children[keep]
+        parent[new] = batch[parents[keep]]
+        code[new] = codes[keep]
+        g[new] = child_g[keep]
+        keys.extend(child_keys[j] for j in keep)
+        for i, child_f in zip(range(new.start, new.stop), g[new] + problem.h_batch(boards[new])):
+            heapq.heappush(frontier, (child_f, i))
+        size = new.stop
+    return None
+
+
+# ______________________________________________________________________________
+# Parallel search
+
+
+def _process_context():
+    """Fork where available: the workers inherit the problem and the search
+    functions, which then need not be picklable."""
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def replay(problem, actions):
+    """Return the node reached by applying actions from the initial state,
+    e.g. to rebuild a goal node from its solution() found elsewhere."""
+    node = Node(problem.initial)
+    for action in actions:
+        node = node.child_node(problem, action)
+    return node
+
+
+def _portfolio_worker(problem, search, conn):
+    try:
+        node = search(problem)
+        if node == 'cutoff':
+            conn.send(('cutoff', 'cut off by its depth or memory bound'))
+        else:
+            conn.send(('done', None if node is None else node.solution()))
+    except Exception as error:
+        conn.send(('error', repr(error)))
+    conn.close()
+
+
+def portfolio_search(problem, searchers, optimal=True, timeout=None):
+    """Run several search algorithms on problem, each in its own process,
+    and return (name, node) for the first one to finish; the others are
+    then terminated. searchers maps a name to a (search, is_optimal) pair,
+    where search(problem) returns a goal node or None. With optimal only
+    the searchers that return a cheapest solution are run. A None returned
+    by any of them ends the race as well: the graph searches are complete,
+    so the problem has no solution. A searcher that returns 'cutoff' (see
+    depth_limited_search and sma_star_search) gave up without an answer,
+    and the race goes on without it. Raises TimeoutError after timeout
+    seconds, and RuntimeError if every searcher failed or was cut off."""
+    context = _process_context()
+    running = {}  # result connection -> (name, process)
+    for name, (search, is_optimal) in searchers.items():
+        if optimal and not is_optimal:
+            continue
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_portfolio_worker, args=(problem, search, sender), daemon=True)
+        process.start()
+        sender.close()
+        running[receiver] = (name, process)
+    if not running:
+        raise ValueError('no searcher meets the optimality requirement')
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    errors = []
+    try:
+        while running:
+            wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+            ready = multiprocessing.connection.wait(list(running), wait)
+            if not ready:
+                raise TimeoutError('no searcher finished in {} seconds'.format(timeout))
+            for receiver in ready:
+                name, process = running.pop(receiver)
+                try:
+                    status, payload = receiver.recv()
+                except EOFError:
+                    status, payload = 'error', 'exit code {}'.format(process.exitcode)
+                receiver.close()
+                process.join()
+                if status == 'done':
+                    return name, None if payload is None else replay(problem, payload)
+                errors.append('{}: {}'.format(name, payload))
+        raise RuntimeError('every searcher failed: ' + '; '.join(errors))
+    finally:
+        for receiver, (name, process) in running.items():
+            process.terminate()
+            receiver.close()
+        for name, process in running.values():
+            process.join()
+
+
+class _ReceivedNode(Node):
+    """Root of the nodes a HDA* worker grows from a state sent by another
+    worker; prefix is the list of actions that led to it."""
+
+    __slots__ = ('prefix',)
+
+    def __init__(self, state, path_cost, prefix):
+        super().__init__(state, path_cost=path_cost)
+        self.prefix = prefix
+
+
+def _hda_star_worker(problem, h, index, inboxes, results, incumbent, sent, received, idle, stop, batch_size):
+    try:
+        _hda_star_expand(problem, h, index, inboxes, results, incumbent, sent, received, idle, stop, batch_size)
+    except Exception as error:
+        results.put(('error', repr(error)))
+    for inbox in inboxes:
+        inbox.cancel_join_thread()
+
+
+def _hda_star_expand(problem, h, index, inboxes, results, incumbent, sent, received, idle, stop, batch_size):
+    h = memoize(h or problem.h, 'h')
+    f = memoize(lambda node: node.path_cost + h(node), 'f')
+    workers = len(inboxes)
+    frontier = IndexedPriorityQueue('min', f, key=lambda node: node.state)
+    best_g = {}
+    outboxes = [[] for _ in range(workers)]
+
+    def owner(state):
+        return hash(state) % workers
+
+    def push(node):
+        g = best_g.get(node.state)
+        if g is None or node.path_cost < g:
+            best_g[node.state] = node.path_cost
+            frontier.append(node)
+
+    def receive(batch):
+        idle[index] = 0
+        for state, path_cost, prefix in batch:
+            push(_ReceivedNode(state, path_cost, prefix))
+        received[index] += len(batch)
+
+    def path(node):
+        nodes = node.path()
+        return getattr(nodes[0], 'prefix', []) + [n.action for n in nodes[1:]]
+
+    def flush():
+        for target, outbox in enumerate(outboxes):
+            if outbox:
+                sent[index] += len(outbox)
+                inboxes[target].put(outbox)
+                outboxes[target] = []
+
+    if owner(problem.initial) == index:
+        push(Node(problem.initial))
+    inbox = inboxes[index]
+    while not stop.is_set():
+        while True:
+            try:
+                batch = inbox.get_nowait()
+            except queue.Empty:
+                break
+            receive(batch)
+        expanded = 0
+        while frontier and expanded < batch_size:
+            node = frontier.pop()
+            if f(node) >= incumbent.value:
+                continue
+            expanded += 1
+            if problem.goal_test_node(node):
+                with incumbent.get_lock():
+                    if node.path_cost < incumbent.value:
+                        incumbent.value = node.path_cost
+                        results.put(('goal', (node.path_cost, path(node))))
+                continue
+            for child in node.expand(problem):
+                target = owner(child.state)
+                if target == index:
+                    push(child)
+                elif f(child) < incumbent.value:
+                    outboxes[target].append((child.state, child.path_cost, path(child)))
+                    if len(outboxes[target]) >= batch_size:
+                        sent[index] += batch_size
+                        inboxes[target].put(outboxes[target])
+                        outboxes[target] = []
+        flush()
+        if not frontier:
+            idle[index] = 1
+            try:
+                receive(inbox.get(timeout=0.01))
+            except queue.Empty:
+                pass
+
+
+def hda_star_search(problem, h=None, workers=None, batch_size=64, poll=0.01):
+    """Hash distributed A*: workers processes (default: one per core) each
+    own the states s with hash(s) % workers equal to their index, and run
+    A* on them. Children owned by another worker are sent to its inbox in
+    batches of up to batch_size, with the actions that reached them, and a
+    state reached again with a lower g is reopened, so h need only be
+    admissible. The cheapest goal found so far, the incumbent, is shared and
+    nodes with f not below its cost are pruned. The search ends when every
+    worker is out of nodes and no batch is in transit, which is when the
+    incumbent cost is at most every worker's minimum f: the incumbent is
+    then optimal. States must be picklable, and hash the same way in every
+    worker, which forked workers do."""
+    context = _process_context()
+    workers = workers or os.cpu_count() or 1
+    inboxes = [context.Queue() for _ in range(workers)]
+    results = context.Queue()
+    incumbent = context.Value('d', np.inf)
+    # sent and received count the states in batches, idle the workers out of nodes
+    sent = context.Array('q', workers, lock=False)
+    received = context.Array('q', workers, lock=False)
+    idle = context.Array('b', workers, lock=False)
+    stop = context.Event()
+    processes = [context.Process(target=_hda_star_worker, daemon=True,
+                                 args=(problem, h, index, inboxes, results, incumbent,
+                                       sent, received, idle, stop, batch_size))
+                 for index in range(workers)]
+    for process in processes:
+        process.start()
+
+    best = None
+
+    def collect(timeout):
+        nonlocal best
+        try:
+            kind, payload = results.get(timeout=timeout)
+        except queue.Empty:
+            return
+        if kind == 'error':
+            raise RuntimeError('HDA* worker failed: ' + payload)
+        if best is None or payload[0] < best[0]:
+            best = payload
+
+    try:
+        while True:
+            collect(poll)
+            # no state was sent or received while the idle flags were read
+            counts = (sum(sent), sum(received))
+            done = all(idle) and counts[0] == counts[1]
+            if done and counts == (sum(sent), sum(received)):
+                break
+            if not all(process.is_alive() for process in processes):
+                raise RuntimeError('HDA* worker exited')
+    finally:
+        stop.set()
+        for process in processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+    # a goal may have been sent just before the end
+    while not results.empty():
+        collect(0.1)
+    return None if best is None else replay(problem, best[1])
+
+
 def hill_climbing(problem):
     """
     [Figure 4.2]
@@ -1526,6 +2176,10 @@ class InstrumentedProblem(Problem):
         self.succs += 1
         return self.problem.actions(state)
 
+    def node_actions(self, node):
+        self.succs += 1
+        return self.problem.node_actions(node)
+
     def result(self, state, action):
         self.states += 1
         return self.problem.result(state, action)
@@ -1537,12 +2191,22 @@ class InstrumentedProblem(Problem):
             self.found = state
         return result
 
+    def goal_test_node(self, node):
+        self.goal_tests += 1
+        result = self.problem.goal_test_node(node)
+        if result:
+            self.found = node.state
+        return result
+
     def path_cost(self, c, state1, action, state2):
         return self.problem.path_cost(c, state1, action, state2)
 
     def value(self, state):
         return self.problem.value(state)
 
+    def inverse(self, action):
+        return self.problem.inverse(action)
+
     def __getattr__(self, attr):
         return getattr(self.problem, attr)
 
@@ -1,6 +1,14 @@
-from typing import Tuple, List
+import collections
+import functools
+import hashlib
+import os
+from typing import Callable, Dict, Tuple, List, Union, NamedTuple, Optional
 from enum import Enum, auto
+import numpy as np
+import pattern_db
 import search
+from cache import SolutionCache
+from utils import BucketQueue, IndexedPriorityQueue, min_cost_assignment
 
 
 class Flow(Enum):
@@ -69,22 +77,207 @@ unmovable_tile_types = (
     }
 )
 
+# Tile codes are the same 5 bits as above, but held in an int. The compact
+# encodings store these codes directly instead of 5 ASCII characters.
+map_tile_to_code = {tile: int(bits, 2) for tile, bits in map_tile_to_bytes.items()}
+map_code_to_tile = {code: tile for tile, code in map_tile_to_code.items()}
+map_bytes_to_code = {bits: int(bits, 2) for bits in map_tile_to_bytes.values()}
+
+initial_tile_codes = {map_bytes_to_code[t] for t in initial_tile_types}
+goal_tile_codes = {map_bytes_to_code[t] for t in goal_tile_types}
+unmovable_tile_codes = {map_bytes_to_code[t] for t in unmovable_tile_types}
+EMPTY_CODE = 0b10110
+
+
+# Flow engine tables
+# A tile is the set of sides it is open to, read from its name. A ball
+# arriving from one open side leaves through the other one, so a single
+# table indexed by tile_code * 4 + flow tells where it goes next:
+# (row delta, col delta, outgoing flow, stop). Flows are indexes into
+# sides. stop is PASS to keep walking, END when the ball reaches the
+# opening of an initial or goal tile, and BREAK when it hits a closed side.
+sides = (Flow.TOP, Flow.DOWN, Flow.RIGHT, Flow.LEFT)
+side_delta = {Flow.TOP: (-1, 0), Flow.DOWN: (1, 0), Flow.RIGHT: (0, 1), Flow.LEFT: (0, -1)}
+opposite_side = {Flow.TOP: Flow.DOWN, Flow.DOWN: Flow.TOP, Flow.RIGHT: Flow.LEFT, Flow.LEFT: Flow.RIGHT}
+tile_openings = {
+    code: tuple(side for side in sides if side.name.lower() in tile.split("-"))
+    for tile, code in map_tile_to_code.items()
+}
+
+PASS, END, BREAK = 0, 1, 2
+
+
+def _exit_through(side: Flow) -> Tuple[int, int, int, int]:
+    """Table entry of a ball leaving the current tile through side."""
+    dy, dx = side_delta[side]
+    return dy, dx, sides.index(opposite_side[side]), PASS
+
+
+def _compile_flow_tables():
+    """
+    Build flow_table (see above) and start_table, the exit of the
+    initial and goal tiles, where the walks start.
+    """
+    flow = [(0, 0, 0, BREAK)] * (32 * 4)
+    start = [(0, 0, 0, BREAK)] * 32
+    for code, openings in tile_openings.items():
+        for side in openings:
+            others = [other for other in openings if other != side]
+            if others:
+                flow[code * 4 + sides.index(side)] = _exit_through(others[0])
+            else:
+                flow[code * 4 + sides.index(side)] = (0, 0, 0, END)
+                start[code] = _exit_through(side)
+    return flow, start
+
+
+flow_table, start_table = _compile_flow_tables()
+# the same tables as arrays, for the batch walks
+flow_array = np.array(flow_table, dtype=np.intp)
+start_array = np.array(start_table, dtype=np.intp)
+
+
+class Encoding(Enum):
+    """
+    *Encoding* is the memory layout of a state.
+
+    ASCII is the original layout, 5 characters per tile. BYTE keeps one byte
+    per tile (the tile code) and PACKED a single int with 5 bits per tile,
+    tile n in bits 5*n to 5*n+4. Every RTBProblem method works on all three.
+    """
+
+    ASCII = auto()
+    BYTE = auto()
+    PACKED = auto()
+
+
 # Typing Definitions
-# TODO OUTDATED
-# State is a tuple of varying size of strings (tile names)
+# Board is the tiles in one of the Encoding layouts: bytes for ASCII and BYTE,
+# int for PACKED.
+# State is a Board, or a (Board, empties) tuple when the problem tracks the
+# empty-cells, empties being the sorted tuple of their 1d indexes.
 # Actions type is a tuple of varying size of Action
-# Each Action is a tuple with ((y,x), direction), a tile (only empty-cell) position
-# and a direction to move.
-State = bytes
+# Each Action is a tuple with ((y,x), (y,x)), the location of an empty-cell
+# and the location of the tile that slides into it.
+Board = Union[bytes, int]
+State = Union[Board, Tuple[Board, Tuple[int, ...]]]
 Location = Tuple[int, int]
 Action = Tuple[Location, Location]
 Actions = Tuple[Action, ...]
 
 
+class Walk(NamedTuple):
+    """
+    A ball walk from the initial (or goal) tile.
+
+    reached tells if it got to the other end, end is the location the
+    _follow_path_* methods return, cells the 1d indexes of the tiles it
+    looked at after the start (the last one is where it stopped), and
+    flows the flow the ball arrived with at each of them. steps maps each
+    of these cells to its first step, counted from the start.
+
+    A walk resumed from another one shares its first *offset* steps with
+    the *prefix* walk, and only holds those that follow in cells, flows
+    and steps. A prefix may itself be resumed from another walk, so step()
+    and at() follow the chain of prefix walks back to the steps they need.
+    """
+
+    reached: bool
+    end: Location
+    cells: Tuple[int, ...]
+    flows: Tuple[int, ...]
+    steps: Dict[int, int]
+    prefix: Optional["Walk"] = None
+    offset: int = 0
+
+    def step(self, cell: int) -> Optional[int]:
+        """The first step of the walk on cell, None if it is not on it."""
+        walk, limit, found = self, len(self.cells) + self.offset, None
+        while walk is not None:
+            step = walk.steps.get(cell)
+            if step is not None and step < limit:
+                found = step
+            limit = min(limit, walk.offset)
+            walk = walk.prefix
+        return found
+
+    def at(self, step: int) -> Tuple[int, int]:
+        """The cell and the flow of the walk at step."""
+        walk = self
+        while step < walk.offset:
+            walk = walk.prefix
+        return walk.cells[step - walk.offset], walk.flows[step - walk.offset]
+
+
+class Searcher(NamedTuple):
+    """
+    An entry of the solver portfolio (see RTBProblem.setPortfolio).
+
+    search(problem) returns a goal node, None, or 'cutoff' when it gave up
+    within its bounds, and optimal tells if that goal node is always a
+    cheapest one. heuristic names the RTBProblem method given to search as
+    h, for the heuristic variants of a search.
+    """
+
+    search: Callable
+    optimal: bool
+    heuristic: Optional[str] = None
+
+
+def _greedy_search(problem, h=None):
+    return search.greedy_best_first_graph_search(problem, h or problem.h)
+
+
+def _weighted_astar_search(problem, h=None, weight=2):
+    h = search.memoize(h or problem.h, "h")
+    return search.best_first_graph_search(problem, lambda n: n.path_cost + weight * h(n))
+
+
+def _run_searcher(searcher: Searcher, problem):
+    if searcher.heuristic is None:
+        return searcher.search(problem)
+    return searcher.search(problem, h=getattr(problem, searcher.heuristic))
+
+
+# breadth-first is optimal too, every move costs 1
+PORTFOLIO = {
+    "astar": Searcher(search.astar_search, True),
+    "astar-deeper": Searcher(functools.partial(search.astar_search, prefer_deeper=True), True),
+    "ucs": Searcher(search.uniform_cost_search, True),
+    "bfs": Searcher(search.breadth_first_graph_search, True),
+    "rbfs": Searcher(search.recursive_best_first_search, True),
+    "ida": Searcher(search.ida_star_search, True),
+    "sma": Searcher(search.sma_star_search, True),
+    "astar-pdb": Searcher(search.astar_search, True, "h_pdb"),
+    "astar-transport": Searcher(search.astar_search, True, "h_transport"),
+    "greedy": Searcher(_greedy_search, False),
+    "weighted-astar": Searcher(_weighted_astar_search, False),
+}
+
+
 class RTBProblem(search.Problem):
-    def __init__(self):
+    def __init__(
+        self,
+        encoding: Encoding = Encoding.ASCII,
+        track_empties=False,
+        drop_static=False,
+        prune_commuting=False,
+    ):
         """
-        State is a 1d binary object with N*N*TILE_ENCODING length.
+        State is a 1d object with the N*N tiles of the board, laid out
+        as selected by *encoding* (see Encoding).
+
+        With *track_empties* the state also carries the indexes of the
+        empty-cells, kept up to date by result(), so actions() does not
+        have to search the board for them.
+
+        With *drop_static* the state only holds the tiles that can move:
+        fixed and frozen tiles (see _build_move_tables) are kept once in
+        the problem instead, and the tile at cell n is in slot
+        self._slot[n] of the state.
+
+        With *prune_commuting* node_actions leaves out the moves that
+        commute with the move that led to the node (see node_actions).
 
         There's 23 different types of tiles, so we need at least 5 bits
         to encode all of each tile types.
@@ -98,14 +291,38 @@ class RTBProblem(search.Problem):
         """
         self.initial: State = b""
         self.algorithm = None
+        self.portfolio_winner: Optional[str] = None
+        # whether the algorithm always returns a cheapest solution
+        self.optimal = True
+        self.cache: Optional[SolutionCache] = None
+        # pattern databases of h_pdb, see load_pdb
+        self._patterns: Optional[List[Tuple[Tuple[int, ...], Tuple[int, ...], frozenset, np.ndarray]]] = None
+        self._pdb_additive = False
+        # cells, compatible codes and slide distances of h_transport, see _build_transport
+        self._transport: Optional[Tuple[Tuple[int, ...], np.ndarray, np.ndarray]] = None
+        self.encoding = encoding
+        self.track_empties = track_empties
         self.N = 0
         self.init_tile_loc = (0, 0)
         self.goal_tile_loc = (0, 0)
         self.init_goal_dist = 0
+        # per board move tables, see _build_move_tables
+        self._movable_cells: Tuple[int, ...] = ()
+        self._moves: List[Tuple[Tuple[int, Action], ...]] = []
+        self._move_actions: Actions = ()
+        self._move_pairs = np.empty((0, 2), dtype=np.intp)
+        self.frozen_cells: Tuple[int, ...] = ()
+        self.drop_static = drop_static
+        self.prune_commuting = prune_commuting
+        # cell -> slot in the state, -1 for the cells in self._static_codes
+        self._slot: List[int] = []
+        self._static_codes: List[Optional[int]] = []
+        self._tile_at = getattr(self, "_tile_at_" + encoding.name.lower())
+        self._swap = getattr(self, "_swap_" + encoding.name.lower())
 
     def load(self, fh):
         """Loads an RTB puzzle from the file object fh. You may initialize self.initial here."""
-        board: bytes = b""
+        codes: List[int] = []
 
         for line in fh.read().splitlines():
             if line == "":
@@ -119,10 +336,15 @@ class RTBProblem(search.Problem):
                 continue
             else:
                 # all other lines correspond sequentially to each board line configuration.
-                row = [map_tile_to_bytes[tile] for tile in line.split()]
-                board = b"".join([board, *row])
+                codes.extend(map_tile_to_code[tile] for tile in line.split())
 
-        self.initial = board
+        self._build_move_tables(codes)
+        self._transport = None
+        self._patterns = None
+        self._pdb_additive = False
+        if self.drop_static:
+            self._build_slots(codes)
+        self.initial = self.encode(codes)
         self.init_tile_loc = self._find_init(self.initial)
         self.goal_tile_loc = self._find_goal(self.initial)
         # useful for heuristic function
@@ -132,20 +354,158 @@ class RTBProblem(search.Problem):
             - 1
         )
 
+    def _build_move_tables(self, codes: List[int]):
+        """
+        Precompute, for each cell, the neighbors an empty-cell there can
+        take a tile from.
+
+        Fixed tiles (initial, goal and *-not) never leave their cell, so
+        neighbors holding one, and neighbors outside the board, are left
+        out once here instead of checked on every actions() call. Each
+        entry keeps the neighbor index and the ready made action, in the
+        UP, DOWN, LEFT, RIGHT order.
+
+        Tiles only move into a neighboring empty-cell, so an empty-cell
+        stays in its region, the cells that are not fixed and are
+        connected to each other. The tiles of a region without empty-cells
+        never move either: they are frozen, and count as fixed tiles here.
+        """
+        N = self.N
+        free = {n for n in range(N * N) if codes[n] not in unmovable_tile_codes}
+        frozen = set()
+        while free:
+            region, todo, has_empty = [], [free.pop()], False
+            while todo:
+                n = todo.pop()
+                region.append(n)
+                has_empty = has_empty or codes[n] == EMPTY_CODE
+                y, x = divmod(n, N)
+                for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+                    if 0 <= ny < N and 0 <= nx < N and ny * N + nx in free:
+                        free.remove(ny * N + nx)
+                        todo.append(ny * N + nx)
+            if not has_empty:
+                frozen.update(region)
+        self.frozen_cells = tuple(sorted(frozen))
+        self._movable_cells = tuple(
+            n for n in range(N * N) if codes[n] not in unmovable_tile_codes and n not in frozen
+        )
+        movable = set(self._movable_cells)
+        self._moves = [() for _ in range(N * N)]
+        for n in self._movable_cells:
+            y, x = n // N, n % N
+            moves = []
+            for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+                if 0 <= ny < N and 0 <= nx < N and ny * N + nx in movable:
+                    moves.append((ny * N + nx, ((y, x), (ny, nx))))
+            self._moves[n] = tuple(moves)
+        # the same moves numbered for the batch methods, in actions() order
+        self._move_actions = tuple(action for n in self._movable_cells for _, action in self._moves[n])
+        self._move_pairs = np.array(
+            [(n, neighbor) for n in self._movable_cells for neighbor, _ in self._moves[n]],
+            dtype=np.intp,
+        ).reshape(-1, 2)
+
+    def _build_slots(self, codes: List[int]):
+        """
+        Lay the state out for drop_static: only the movable cells get a
+        slot, and the tile_at and swap methods go through self._slot.
+        """
+        self._slot = slot_of = [-1] * (self.N * self.N)
+        for slot, n in enumerate(self._movable_cells):
+            slot_of[n] = slot
+        # a static cell reads as its code, a movable one as a slot of the state
+        self._static_codes = static = [code if slot < 0 else None for code, slot in zip(codes, slot_of)]
+        tile_at_slot = getattr(self, "_tile_at_" + self.encoding.name.lower())
+        swap_slots = getattr(self, "_swap_" + self.encoding.name.lower())
+
+        def tile_at(state: Board, n: int) -> int:
+            code = static[n]
+            return tile_at_slot(state, slot_of[n]) if code is None else code
+
+        def swap(state: Board, i: int, j: int) -> Board:
+            return swap_slots(state, slot_of[i], slot_of[j])
+
+        self._tile_at = tile_at
+        self._swap = swap
+
+    def encode(self, codes: List[int]) -> State:
+        """Build a state from the list of N*N tile codes, in row order."""
+        tiles = [codes[n] for n in self._movable_cells] if self.drop_static else codes
+        if self.encoding == Encoding.ASCII:
+            board = b"".join(map_tile_to_bytes[map_code_to_tile[code]] for code in tiles)
+        elif self.encoding == Encoding.BYTE:
+            board = bytes(tiles)
+        else:
+            board = 0
+            for n, code in enumerate(tiles):
+                board |= code << (5 * n)
+        if self.track_empties:
+            return board, tuple(n for n, code in enumerate(codes) if code == EMPTY_CODE)
+        return board
+
+    def decode(self, state: State) -> List[int]:
+        """Return the list of N*N tile codes of a state, in row order."""
+        board = self._board_of(state)
+        return [self._tile_at(board, n) for n in range(self.N * self.N)]
+
+    def _board_of(self, state: State) -> Board:
+        """Return the tiles of a state, without the empty-cells if tracked."""
+        return state[0] if self.track_empties else state
+
+    def tiles(self, state: State) -> List[List[str]]:
+        """Return the board of a state as rows of tile names, for output."""
+        codes = self.decode(state)
+        return [
+            [map_code_to_tile[code] for code in codes[row * self.N : (row + 1) * self.N]]
+            for row in range(self.N)
+        ]
+
+    def _tile_at_ascii(self, state: bytes, n: int) -> int:
+        return map_bytes_to_code[state[n * 5 : n * 5 + 5]]
+
+    def _tile_at_byte(self, state: bytes, n: int) -> int:
+        return state[n]
+
+    def _tile_at_packed(self, state: int, n: int) -> int:
+        return (state >> (5 * n)) & 0b11111
+
+    def _swap_ascii(self, state: bytes, i: int, j: int) -> bytes:
+        state_list = bytearray(state)
+        # swap elements in a list
+        (state_list[i * 5 : i * 5 + 5], state_list[j * 5 : j * 5 + 5]) = (
+            state_list[j * 5 : j * 5 + 5],
+            state_list[i * 5 : i * 5 + 5],
+        )
+        # transform list back to binary representation.
+        return bytes(state_list)
+
+    def _swap_byte(self, state: bytes, i: int, j: int) -> bytes:
+        state_list = bytearray(state)
+        state_list[i], state_list[j] = state_list[j], state_list[i]
+        return bytes(state_list)
+
+    def _swap_packed(self, state: int, i: int, j: int) -> int:
+        # xor the two tiles with their difference to exchange them in place
+        diff = ((state >> (5 * i)) ^ (state >> (5 * j))) & 0b11111
+        return state ^ (diff << (5 * i)) ^ (diff << (5 * j))
+
     def _loc_to_index(self, loc: Location) -> int:
         return int(self.N * loc[0] + loc[1])
 
     def _find_init(self, state) -> Location:
         """Locate the initial tile in the state."""
+        state = self._board_of(state)
         for n in range(self.N * self.N):
-            if state[n * 5 : n * 5 + 5] in initial_tile_types:
+            if self._tile_at(state, n) in initial_tile_codes:
                 return n // self.N, n % self.N
         raise ValueError("did not find initial tile")
 
     def _find_goal(self, state) -> Location:
         """Locate the goal tile in the state."""
+        state = self._board_of(state)
         for n in range(self.N * self.N):
-            if state[n * 5 : n * 5 + 5] in goal_tile_types:
+            if self._tile_at(state, n) in goal_tile_codes:
                 return n // self.N, n % self.N
         raise ValueError("did not find goal tile")
 
@@ -156,196 +516,173 @@ class RTBProblem(search.Problem):
 
     def result(self, state: State, action: Action) -> State:
         """Return the state that results from executing the given action in the given state."""
-        loc_index = int(self.N * action[0][0] + action[0][1])  # to call only once
-        loc_neighbor_index = int(
-            self.N * action[1][0] + action[1][1]
-        )  # self._loc_to_index(action[1])
+        empty = self.N * action[0][0] + action[0][1]
+        neighbor = self.N * action[1][0] + action[1][1]
+        if self.track_empties:
+            board, empties = state
+            # the tile slides into the empty-cell, which moves to its place
+            return (
+                self._swap(board, empty, neighbor),
+                tuple(sorted(neighbor if n == empty else n for n in empties)),
+            )
+        return self._swap(state, empty, neighbor)
 
-        state_list = list(state)
+    def inverse(self, action: Action) -> Action:
+        """The tile slides back into the cell it came from."""
+        return action[1], action[0]
 
-        # swap elements in a list
-        (
-            state_list[loc_index * 5 : loc_index * 5 + 5],
-            state_list[loc_neighbor_index * 5 : loc_neighbor_index * 5 + 5],
-        ) = (
-            state_list[loc_neighbor_index * 5 : loc_neighbor_index * 5 + 5],
-            state_list[loc_index * 5 : loc_index * 5 + 5],
+    def node_actions(self, node) -> Actions:
+        """
+        Return the actions to expand node with.
+
+        Two moves that touch four different cells (two empty-cells far
+        apart) lead to the same state in either order. With
+        prune_commuting, only the order with the lower action first is
+        expanded: a move lower than node.action that commutes with it is
+        left out. Any path can be reordered into one that is never pruned,
+        by swapping adjacent commuting moves, with the same cost and end
+        state, so breadth-first, uniform cost and A* still find a cheapest
+        solution.
+        """
+        actions = self.actions(node.state)
+        last = node.action
+        if not self.prune_commuting or last is None:
+            return actions
+        return tuple(
+            action for action in actions
+            if action > last or action[0] in last or action[1] in last
         )
-        # transform list back to binary representation.
-        return bytes(state_list)
 
     def actions(self, state: State) -> Actions:
         """
         Return the actions that can be executed in the given state.
+
+        An empty-cell can take the tile of any of its movable neighbors
+        (see _build_move_tables) that is not another empty-cell.
         """
+        tile_at = self._tile_at
+        if self.track_empties:
+            board, empties = state
+        else:
+            board = state
+            empties = [n for n in self._movable_cells if tile_at(board, n) == EMPTY_CODE]
         actions = []
-        # state_list = self._state_to_list(state)
-
-        def _find_empties() -> List[Location]:
-            """
-            return the locations of 'empty-cell' (b"10110") tiles in state
-            """
-            locs = []
-
-            for n in range(self.N * self.N):
-                t = state[n * 5 : n * 5 + 5]
-                if t == b"10110":
-                    locs.append((n // self.N, n % self.N))
-
-            return locs
-
-        def _valid_destination(candidate_loc):
-            """
-            test if the candidate location is inside bounds and
-            the tile is not unmovable or another empty-cell
-            """
-            if (
-                candidate_loc[0] < 0
-                or candidate_loc[0] >= self.N
-                or candidate_loc[1] < 0
-                or candidate_loc[1] >= self.N
-            ):
-                return False
-            tile = state[
-                (candidate_loc[0] * self.N + candidate_loc[1])
-                * 5 : (candidate_loc[0] * self.N + candidate_loc[1])
-                * 5
-                + 5
-            ]
-            if tile in unmovable_tile_types | {b"10110"}:
-                return False
-            return True
-
-        empties = _find_empties()
-        for empty_loc in empties:
-            # Direction UP
-            candidate_loc = empty_loc[0] - 1, empty_loc[1]
-            if _valid_destination(candidate_loc):
-                actions.append((empty_loc, candidate_loc))
-            # Direction DOWN
-            candidate_loc = empty_loc[0] + 1, empty_loc[1]
-            if _valid_destination(candidate_loc):
-                actions.append((empty_loc, candidate_loc))
-            # Direction LEFT
-            candidate_loc = empty_loc[0], empty_loc[1] - 1
-            if _valid_destination(candidate_loc):
-                actions.append((empty_loc, candidate_loc))
-            # Direction RIGHT
-            candidate_loc = empty_loc[0], empty_loc[1] + 1
-            if _valid_destination(candidate_loc):
-                actions.append((empty_loc, candidate_loc))
+        for empty in empties:
+            for neighbor, action in self._moves[empty]:
+                if tile_at(board, neighbor) != EMPTY_CODE:
+                    actions.append(action)
 
         return tuple(actions)
 
+    def to_array(self, states) -> np.ndarray:
+        """Return the boards of a sequence of K states as a (K, N*N) uint8
+        array of tile codes, the layout of the batch methods."""
+        boards = np.empty((len(states), self.N * self.N), dtype=np.uint8)
+        for k, state in enumerate(states):
+            board = self._board_of(state)
+            if self.encoding == Encoding.BYTE and not self.drop_static:
+                boards[k] = np.frombuffer(board, dtype=np.uint8)
+            else:
+                boards[k] = self.decode(state)
+        return boards
+
+    def from_array(self, boards: np.ndarray) -> List[State]:
+        """Return the states of a (K, N*N) array of boards."""
+        if self.encoding == Encoding.BYTE and not self.track_empties:
+            if self.drop_static:
+                boards = boards[:, self._movable_cells]
+            return [row.tobytes() for row in boards]
+        return [self.encode(row.tolist()) for row in boards]
+
+    def expand_batch(self, boards: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Generate the children of K boards at once.
+
+        boards is a (K, N*N) uint8 array (see to_array). Returns the
+        (C, N*N) array of every child board, the index in boards of the
+        parent of each child, and the code of the move that produced it
+        (action_from_code gives the action). Children come grouped by
+        parent, in the order of actions().
+        """
+        empties, neighbors = self._move_pairs[:, 0], self._move_pairs[:, 1]
+        valid = (boards[:, empties] == EMPTY_CODE) & (boards[:, neighbors] != EMPTY_CODE)
+        parents, codes = np.nonzero(valid)
+        children = boards[parents]
+        rows = np.arange(len(children))
+        children[rows, empties[codes]] = children[rows, neighbors[codes]]
+        children[rows, neighbors[codes]] = EMPTY_CODE
+        return children, parents, codes
+
+    def action_from_code(self, code: int) -> Action:
+        """Return the action of a move code of expand_batch."""
+        return self._move_actions[code]
+
+    def walk_batch(self, boards: np.ndarray, backward: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Follow the ball on K boards at once, the array version of _walk.
+
+        Every board takes one step per iteration through flow_array; the
+        boards whose walk is over are masked out of the next ones. Walks
+        start at the initial tile, or at the goal tile when *backward*.
+        Returns whether each walk reached the other end, and the (K, 2)
+        array of the locations _walk returns as end.
+        """
+        N = self.N
+        K = len(boards)
+        (y0, x0), targets = (
+            (self.goal_tile_loc, initial_tile_codes) if backward
+            else (self.init_tile_loc, goal_tile_codes)
+        )
+        is_target = np.zeros(32, dtype=bool)
+        is_target[list(targets)] = True
+        dy, dx, flow, _ = start_array[boards[:, y0 * N + x0]].T.copy()
+        y, x = np.full(K, y0), np.full(K, x0)
+        last_y, last_x = y.copy(), x.copy()
+        reached = np.zeros(K, dtype=bool)
+        walking = np.arange(K)
+        # a walk never visits a tile twice
+        for _ in range(N * N):
+            next_y, next_x = y[walking] + dy[walking], x[walking] + dx[walking]
+            inside = (next_y >= 0) & (next_y < N) & (next_x >= 0) & (next_x < N)
+            walking, next_y, next_x = walking[inside], next_y[inside], next_x[inside]
+            if not len(walking):
+                break
+            last_y[walking], last_x[walking] = y[walking], x[walking]
+            y[walking], x[walking] = next_y, next_x
+            tiles = boards[walking, next_y * N + next_x]
+            dy[walking], dx[walking], flow[walking], stop = flow_array[tiles * 4 + flow[walking]].T
+            hit = walking[(stop == END) & is_target[tiles]]
+            reached[hit] = True
+            last_y[hit], last_x[hit] = y[hit], x[hit]
+            walking = walking[stop == PASS]
+        return reached, np.stack((last_y, last_x), axis=1)
+
+    def goal_test_batch(self, boards: np.ndarray) -> np.ndarray:
+        """Return the goal_test of each board of a (K, N*N) array."""
+        return self.walk_batch(boards)[0]
+
+    def h_batch(self, boards: np.ndarray) -> np.ndarray:
+        """Return the h of each board of a (K, N*N) array, from the break
+        points of walk_batch in both directions (see h)."""
+        flow_init = self.walk_batch(boards)[1]
+        flow_goal = self.walk_batch(boards, backward=True)[1]
+        init = np.array(self.init_tile_loc)
+        goal = np.array(self.goal_tile_loc)
+        d1 = np.abs(flow_goal - flow_init).sum(axis=1) - 1
+        d2 = np.abs(flow_goal - init).sum(axis=1) - 1
+        d3 = np.abs(goal - flow_init).sum(axis=1) - 1
+        h = np.minimum.reduce([d1, d2, d3, np.full(len(boards), min(self.init_goal_dist, 2))])
+        return np.maximum(h, 0)
+
     def goal_test(self, state) -> bool:
         """Return True if the state is a goal."""
-        # initial position, flow will not be defined, can be any value
-        loc, flow = self.init_tile_loc, Flow.DOWN
-        # set first tile type, one of initial types
-        tile = state[
-            (loc[0] * self.N + loc[1]) * 5 : (loc[0] * self.N + loc[1]) * 5 + 5
-        ]
+        return self._walk(self._board_of(state), self.init_tile_loc, goal_tile_codes).reached
 
-        first = (
-            True  # flag to check first passage in initial type tile to prevent loops
-        )
-        while True:
-            if (
-                tile == b"01110" or tile == b"10101" or tile == b"10110"
-            ):  # follow_no_passage,
-                return False
-            elif tile == b"00000":  # follow_initial_left
-                if first:
-                    loc, flow = ((loc[0], loc[1] - 1), Flow.RIGHT)
-                else:
-                    return False
-            elif tile == b"00001":  # follow_initial_right
-                if first:
-                    loc, flow = ((loc[0], loc[1] + 1), Flow.LEFT)
-                else:
-                    return False
-            elif tile == b"00010":  # follow_initial_top
-                if first:
-                    loc, flow = ((loc[0] - 1, loc[1]), Flow.DOWN)
-                else:
-                    return False
-            elif tile == b"00011":  # follow_initial_down
-                if first:
-                    loc, flow = ((loc[0] + 1, loc[1]), Flow.TOP)
-                else:
-                    return False
-            elif tile == b"00100":  # follow_goal_left
-                if flow == Flow.LEFT:
-                    return True
-                return False
-            elif tile == b"00101":  # follow_goal_right
-                if flow == Flow.RIGHT:
-                    return True
-                return False
-            elif tile == b"00110":  # follow_goal_top
-                if flow == Flow.TOP:
-                    return True
-                return False
-            elif tile == b"00111":  # follow_goal_down
-                if flow == Flow.DOWN:
-                    return True
-                return False
-            elif tile == b"01000" or tile == b"01111":  # follow_right_left
-                if flow == Flow.LEFT:
-                    loc = (loc[0], loc[1] + 1)
-                elif flow == Flow.RIGHT:
-                    loc = (loc[0], loc[1] - 1)
-                else:
-                    return False
-            elif tile == b"01001" or tile == b"10000":  # follow_top_down
-                if flow == Flow.TOP:
-                    loc = (loc[0] + 1, loc[1])
-                elif flow == Flow.DOWN:
-                    loc = (loc[0] - 1, loc[1])
-                else:
-                    return False
-            elif tile == b"01010" or tile == b"10001":  # follow_right_top
-                if flow == Flow.RIGHT:
-                    loc, flow = ((loc[0] - 1, loc[1]), Flow.DOWN)
-                elif flow == Flow.TOP:
-                    loc, flow = ((loc[0], loc[1] + 1), Flow.LEFT)
-                else:
-                    return False
-            elif tile == b"01011" or tile == b"10010":  # follow_right_down
-                if flow == Flow.RIGHT:
-                    loc, flow = ((loc[0] + 1, loc[1]), Flow.TOP)
-                elif flow == Flow.DOWN:
-                    loc, flow = ((loc[0], loc[1] + 1), Flow.LEFT)
-                else:
-                    return False
-            elif tile == b"01100" or tile == b"10011":  # follow_left_top
-                if flow == Flow.LEFT:
-                    loc, flow = ((loc[0] - 1, loc[1]), Flow.DOWN)
-                elif flow == Flow.TOP:
-                    loc, flow = ((loc[0], loc[1] - 1), Flow.RIGHT)
-                else:
-                    return False
-            elif tile == b"01101" or tile == b"10100":  # follow_left_down
-                if flow == Flow.LEFT:
-                    loc, flow = ((loc[0] + 1, loc[1]), Flow.TOP)
-                elif flow == Flow.DOWN:
-                    loc, flow = ((loc[0], loc[1] - 1), Flow.RIGHT)
-                else:
-                    return False
-            else:
-                raise ValueError("did not find tile type")
-
-            first = False
-            # validate new_loc
-            if loc[0] < 0 or loc[0] >= self.N or loc[1] < 0 or loc[1] >= self.N:
-                return False
-            # get tile at new position
-            tile = state[
-                (loc[0] * self.N + loc[1]) * 5 : (loc[0] * self.N + loc[1]) * 5 + 5
-            ]
-            # continue
+    def goal_test_node(self, node) -> bool:
+        """Return True if the node's state is a goal, reusing the parent's walk."""
+        return self._forward_walk(node).reached
 
-    def _follow_path_forward(self, state) -> Location:  # ???
+    def _follow_path_forward(self, state) -> Location:
         """
         Return the location of the last square the path can
         flow to.
@@ -353,129 +690,7 @@ class RTBProblem(search.Problem):
         Follows the ball flow and if it detects a break returns
         the last valid position (not the current invalid one).
         """
-        # initial position, flow will not be defined, can be any value
-        loc, flow = self.init_tile_loc, Flow.DOWN
-        # set first tile type, one of initial types
-        tile = state[
-            (loc[0] * self.N + loc[1]) * 5 : (loc[0] * self.N + loc[1]) * 5 + 5
-        ]
-
-        first = (
-            True  # flag to check first passage in initial type tile to prevent loops
-        )
-        last = loc
-        last_temp = loc
-        while True:
-            if (
-                tile == b"01110" or tile == b"10101" or tile == b"10110"
-            ):  # follow_no_passage,
-                return last
-            elif tile == b"00000":  # follow_initial_left
-                if first:
-                    last_temp = loc
-                    loc, flow = ((loc[0], loc[1] - 1), Flow.RIGHT)
-                else:
-                    return last
-            elif tile == b"00001":  # follow_initial_right
-                if first:
-                    last_temp = loc
-                    loc, flow = ((loc[0], loc[1] + 1), Flow.LEFT)
-                else:
-                    return last
-            elif tile == b"00010":  # follow_initial_top
-                if first:
-                    last_temp = loc
-                    loc, flow = ((loc[0] - 1, loc[1]), Flow.DOWN)
-                else:
-                    return last
-            elif tile == b"00011":  # follow_initial_down
-                if first:
-                    last_temp = loc
-                    loc, flow = ((loc[0] + 1, loc[1]), Flow.TOP)
-                else:
-                    return last
-            elif tile == b"00100":  # follow_goal_left
-                if flow == Flow.LEFT:
-                    return loc
-                return last
-            elif tile == b"00101":  # follow_goal_right
-                if flow == Flow.RIGHT:
-                    return loc
-                return last
-            elif tile == b"00110":  # follow_goal_top
-                if flow == Flow.TOP:
-                    return loc
-                return last
-            elif tile == b"00111":  # follow_goal_down
-                if flow == Flow.DOWN:
-                    return loc
-                return last
-            elif tile == b"01000" or tile == b"01111":  # follow_right_left
-                if flow == Flow.LEFT:
-                    last_temp = loc
-                    loc = (loc[0], loc[1] + 1)
-                elif flow == Flow.RIGHT:
-                    last_temp = loc
-                    loc = (loc[0], loc[1] - 1)
-                else:
-                    return last
-            elif tile == b"01001" or tile == b"10000":  # follow_top_down
-                if flow == Flow.TOP:
-                    last_temp = loc
-                    loc = (loc[0] + 1, loc[1])
-                elif flow == Flow.DOWN:
-                    last_temp = loc
-                    loc = (loc[0] - 1, loc[1])
-                else:
-                    return last
-            elif tile == b"01010" or tile == b"10001":  # follow_right_top
-                if flow == Flow.RIGHT:
-                    last_temp = loc
-                    loc, flow = ((loc[0] - 1, loc[1]), Flow.DOWN)
-                elif flow == Flow.TOP:
-                    last_temp = loc
-                    loc, flow = ((loc[0], loc[1] + 1), Flow.LEFT)
-                else:
-                    return last
-            elif tile == b"01011" or tile == b"10010":  # follow_right_down
-                if flow == Flow.RIGHT:
-                    last_temp = loc
-                    loc, flow = ((loc[0] + 1, loc[1]), Flow.TOP)
-                elif flow == Flow.DOWN:
-                    last_temp = loc
-                    loc, flow = ((loc[0], loc[1] + 1), Flow.LEFT)
-                else:
-                    return last
-            elif tile == b"01100" or tile == b"10011":  # follow_left_top
-                if flow == Flow.LEFT:
-                    last_temp = loc
-                    loc, flow = ((loc[0] - 1, loc[1]), Flow.DOWN)
-                elif flow == Flow.TOP:
-                    last_temp = loc
-                    loc, flow = ((loc[0], loc[1] - 1), Flow.RIGHT)
-                else:
-                    return last
-            elif tile == b"01101" or tile == b"10100":  # follow_left_down
-                if flow == Flow.LEFT:
-                    last_temp = loc
-                    loc, flow = ((loc[0] + 1, loc[1]), Flow.TOP)
-                elif flow == Flow.DOWN:
-                    last_temp = loc
-                    loc, flow = ((loc[0], loc[1] - 1), Flow.RIGHT)
-                else:
-                    return last
-            else:
-                raise ValueError("did not find tile type")
-
-            first = False
-            # validate new_loc
-            if loc[0] < 0 or loc[0] >= self.N or loc[1] < 0 or loc[1] >= self.N:
-                return last
-            # get tile at new position
-            last = last_temp
-            tile = state[
-                (loc[0] * self.N + loc[1]) * 5 : (loc[0] * self.N + loc[1]) * 5 + 5
-            ]
+        return self._walk(self._board_of(state), self.init_tile_loc, goal_tile_codes).end
 
     def _follow_path_backward(self, state) -> Location:
         """
@@ -485,132 +700,192 @@ class RTBProblem(search.Problem):
 
         Return the location of the last square the path can
         flow to.
+        """
+        return self._walk(self._board_of(state), self.goal_tile_loc, initial_tile_codes).end
+
+    def _forward_walk(self, node) -> Walk:
+        return self._node_walk(node, 0, self.init_tile_loc, goal_tile_codes)
+
+    def _backward_walk(self, node) -> Walk:
+        return self._node_walk(node, 1, self.goal_tile_loc, initial_tile_codes)
 
-        We use last, last_temp because at each tile transversal we
-        can go to a outside invalid location.
+    def _node_walk(self, node, side: int, start: Location, targets) -> Walk:
         """
-        # initial position, flow will not be defined, can be any value
-        loc, flow = self.goal_tile_loc, Flow.DOWN
-        # set first tile type, one of goal types
-        tile = state[
-            (loc[0] * self.N + loc[1]) * 5 : (loc[0] * self.N + loc[1]) * 5 + 5
-        ]
+        Return the walk of a node, kept in node.aux as [forward, backward].
 
-        first = True  # flag to check first passage in goal type tile to prevent loops
-        last = loc
-        last_temp = loc
-        while True:
-            if (
-                tile == b"01110" or tile == b"10101" or tile == b"10110"
-            ):  # follow_no_passage,
-                return last
-            elif tile == b"00000":  # follow_initial_left
-                if flow == Flow.LEFT:
-                    return loc
-                return last
-            elif tile == b"00001":  # follow_initial_right
-                if flow == Flow.RIGHT:
-                    return loc
-                return last
-            elif tile == b"00010":  # follow_initial_top
-                if flow == Flow.TOP:
-                    return loc
-                return last
-            elif tile == b"00011":  # follow_initial_down
-                if flow == Flow.DOWN:
-                    return loc
-                return last
-            elif tile == b"00100":  # follow_goal_left
-                if first:
-                    last_temp = loc
-                    loc, flow = ((loc[0], loc[1] - 1), Flow.RIGHT)
-                else:
-                    return last
-            elif tile == b"00101":  # follow_goal_right
-                if first:
-                    last_temp = loc
-                    loc, flow = ((loc[0], loc[1] + 1), Flow.LEFT)
-                else:
-                    return last
-            elif tile == b"00110":  # follow_goal_top
-                if first:
-                    last_temp = loc
-                    loc, flow = ((loc[0] - 1, loc[1]), Flow.DOWN)
-                else:
-                    return last
-            elif tile == b"00111":  # follow_goal_down
-                if first:
-                    last_temp = loc
-                    loc, flow = ((loc[0] + 1, loc[1]), Flow.TOP)
-                else:
-                    return last
-            elif tile == b"01000" or tile == b"01111":  # follow_right_left
-                if flow == Flow.LEFT:
-                    last_temp = loc
-                    loc = (loc[0], loc[1] + 1)
-                elif flow == Flow.RIGHT:
-                    last_temp = loc
-                    loc = (loc[0], loc[1] - 1)
-                else:
-                    return last
-            elif tile == b"01001" or tile == b"10000":  # follow_top_down
-                if flow == Flow.TOP:
-                    last_temp = loc
-                    loc = (loc[0] + 1, loc[1])
-                elif flow == Flow.DOWN:
-                    last_temp = loc
-                    loc = (loc[0] - 1, loc[1])
-                else:
-                    return last
-            elif tile == b"01010" or tile == b"10001":  # follow_right_top
-                if flow == Flow.RIGHT:
-                    last_temp = loc
-                    loc, flow = ((loc[0] - 1, loc[1]), Flow.DOWN)
-                elif flow == Flow.TOP:
-                    last_temp = loc
-                    loc, flow = ((loc[0], loc[1] + 1), Flow.LEFT)
-                else:
-                    return last
-            elif tile == b"01011" or tile == b"10010":  # follow_right_down
-                if flow == Flow.RIGHT:
-                    last_temp = loc
-                    loc, flow = ((loc[0] + 1, loc[1]), Flow.TOP)
-                elif flow == Flow.DOWN:
-                    last_temp = loc
-                    loc, flow = ((loc[0], loc[1] + 1), Flow.LEFT)
-                else:
-                    return last
-            elif tile == b"01100" or tile == b"10011":  # follow_left_top
-                if flow == Flow.LEFT:
-                    last_temp = loc
-                    loc, flow = ((loc[0] - 1, loc[1]), Flow.DOWN)
-                elif flow == Flow.TOP:
-                    last_temp = loc
-                    loc, flow = ((loc[0], loc[1] - 1), Flow.RIGHT)
-                else:
-                    return last
-            elif tile == b"01101" or tile == b"10100":  # follow_left_down
-                if flow == Flow.LEFT:
-                    last_temp = loc
-                    loc, flow = ((loc[0] + 1, loc[1]), Flow.TOP)
-                elif flow == Flow.DOWN:
-                    last_temp = loc
-                    loc, flow = ((loc[0], loc[1] - 1), Flow.RIGHT)
-                else:
-                    return last
+        A child differs from its parent by the swap of two cells. If none
+        of them is on the parent's walk the child reuses it as is,
+        otherwise only the part of the walk after the first swapped cell
+        is walked again, and the part before it is shared with the
+        parent's walk (see Walk).
+        """
+        aux = getattr(node, "aux", None)
+        if aux is None:
+            aux = node.aux = [None, None]
+        walk = aux[side]
+        if walk is None:
+            board = self._board_of(node.state)
+            parent_aux = getattr(node.parent, "aux", None)
+            if parent_aux is None or parent_aux[side] is None:
+                walk = self._walk(board, start, targets)
             else:
-                raise ValueError("did not find tile type")
-
-            first = False
-            # validate new_loc
-            if loc[0] < 0 or loc[0] >= self.N or loc[1] < 0 or loc[1] >= self.N:
-                return last
-            # get tile at new position
-            # last test (outside) is valid so we can assign last location to memory.
-            last = last_temp
-            tile = state[
-                (loc[0] * self.N + loc[1]) * 5 : (loc[0] * self.N + loc[1]) * 5 + 5
-            ]
+                walk = parent_aux[side]
+                swapped = (
+                    self.N * node.action[0][0] + node.action[0][1],
+                    self.N * node.action[1][0] + node.action[1][1],
+                )
+                steps = [step for step in map(walk.step, swapped) if step is not None]
+                if steps:
+                    walk = self._walk(board, start, targets, walk, min(steps))
+            aux[side] = walk
+        return walk
+
+    def _walk(
+        self,
+        board: Board,
+        start: Location,
+        targets,
+        prefix: Optional[Walk] = None,
+        resume: int = 0,
+    ) -> Walk:
+        """
+        Follow the ball from the start tile (initial or goal) through
+        the flow_table, one lookup per tile, in either direction.
+
+        Return a Walk that reached the *targets* codes, or that broke at
+        last, the last tile whose exit stays inside the board. last_y,
+        last_x only move forward once we know the next location is valid.
+
+        With a *prefix* walk, its first *resume* steps are shared, not
+        copied, and the walk goes on from there, for boards that only
+        changed afterwards: the cost is that of the steps walked again.
+        """
+        N = self.N
+        tile_at = self._tile_at
+        cells, flows, steps = [], [], {}
+        if prefix is None:
+            y, x = start
+            dy, dx, flow, stop = start_table[tile_at(board, y * N + x)]
+        else:
+            # the steps of prefix after its own offset are not needed
+            while resume < prefix.offset:
+                prefix = prefix.prefix
+            y, x = divmod(prefix.at(resume - 1)[0], N) if resume else start
+            cell, flow = prefix.at(resume)
+            dy, dx = cell // N - y, cell % N - x
+        link = (prefix if resume else None, resume)
+        last_y, last_x = y, x
+        while True:
+            next_y, next_x = y + dy, x + dx
+            if next_y < 0 or next_y >= N or next_x < 0 or next_x >= N:
+                return Walk(False, (last_y, last_x), tuple(cells), tuple(flows), steps, *link)
+            last_y, last_x = y, x
+            y, x = next_y, next_x
+            steps.setdefault(y * N + x, resume + len(cells))
+            cells.append(y * N + x)
+            flows.append(flow)
+            tile = tile_at(board, y * N + x)
+            dy, dx, flow, stop = flow_table[tile * 4 + flow]
+            if stop == END:
+                if tile in targets:
+                    return Walk(True, (y, x), tuple(cells), tuple(flows), steps, *link)
+                return Walk(False, (last_y, last_x), tuple(cells), tuple(flows), steps, *link)
+            elif stop == BREAK:
+                return Walk(False, (last_y, last_x), tuple(cells), tuple(flows), steps, *link)
+
+    def _fixed_chain(
+        self, codes: List[int], movable, start: Location, targets, leave: Optional[Flow] = None
+    ) -> Tuple[Optional[int], int, str]:
+        """
+        Follow the ball from the start tile for as long as it stays on
+        fixed (or frozen) tiles, which never change whatever the moves,
+        that is out of the *movable* cells. The ball leaves start through
+        its opening, or through the *leave* side if given.
+
+        Returns (cell, flow, reason): the first non-fixed cell the ball gets
+        to and the flow it arrives with there, or a cell of None when it
+        cannot get past the fixed tiles, reason telling why ("" if it
+        reached the *targets* codes through fixed tiles only).
+        """
+        N = self.N
+        y, x = start
+        dy, dx, flow, _ = start_table[codes[y * N + x]] if leave is None else _exit_through(leave)
+        for _ in range(N * N):
+            y, x = y + dy, x + dx
+            if not self._in_bounds((y, x)):
+                return None, flow, "the path from {} leaves the board".format(start)
+            tile = codes[y * N + x]
+            if y * N + x in movable:
+                return y * N + x, flow, ""
+            dy, dx, flow, stop = flow_table[tile * 4 + flow]
+            if stop == END:
+                if tile in targets:
+                    return None, flow, ""
+                return None, flow, "the path from {} ends at {}".format(start, (y, x))
+            elif stop == BREAK:
+                return None, flow, "the path from {} hits the closed fixed tile at {}".format(start, (y, x))
+        return None, flow, "the path from {} loops".format(start)
+
+    def unsolvable_reason(self) -> Optional[str]:
+        """
+        Look for a reason why the board cannot be solved, without searching.
+
+        Fixed and frozen tiles never move, so the ball walks from the
+        initial (and the goal) tile through them until it reaches a cell
+        that moves can change; it must not leave the board or hit a closed
+        side on the way. From there, a BFS over (cell, flow) pairs looks for a way
+        to the goal tile where any non-fixed cell may hold a tile with any
+        two openings, and fixed tiles are only crossed along their own
+        openings. That is at least as permissive as the moves, so no way
+        means no solution, and so does a way needing more non-fixed cells
+        than there are movable pipe tiles, or a first or last non-fixed cell
+        that no movable tile can connect.
+
+        Returns None when none of this rules the board out.
+        """
+        N = self.N
+        codes = self.decode(self.initial)
+        movable = set(self._movable_cells)
+        first, first_flow, reason = self._fixed_chain(codes, movable, self.init_tile_loc, goal_tile_codes)
+        if first is None:
+            return reason or None
+        last, last_flow, reason = self._fixed_chain(codes, movable, self.goal_tile_loc, initial_tile_codes)
+        if last is None:
+            return reason or None
+
+        pipes = [codes[n] for n in self._movable_cells if len(tile_openings[codes[n]]) == 2]
+        for cell, flow in ((first, first_flow), (last, last_flow)):
+            if not any(sides[flow] in tile_openings[code] for code in pipes):
+                return "no movable tile connects to the fixed path at {}".format(divmod(cell, N))
+
+        # BFS, cost being the number of non-fixed cells the ball went through
+        cost = {(first, first_flow): 1}
+        queue = collections.deque([(first, first_flow)])
+        while queue:
+            cell, flow = queue.popleft()
+            c = cost[(cell, flow)]
+            for out, side in enumerate(sides):
+                if out == flow:
+                    continue
+                y, x = divmod(cell, N)
+                dy, dx, next_flow, stop = _exit_through(side)
+                # cross the fixed tiles up to the next non-fixed cell
+                while stop == PASS:
+                    y, x = y + dy, x + dx
+                    if not self._in_bounds((y, x)):
+                        break
+                    tile = codes[y * N + x]
+                    if y * N + x in movable:
+                        if (y * N + x, next_flow) not in cost:
+                            cost[(y * N + x, next_flow)] = c + 1
+                            queue.append((y * N + x, next_flow))
+                        break
+                    dy, dx, next_flow, stop = flow_table[tile * 4 + next_flow]
+                    if stop == END and tile in goal_tile_codes:
+                        if c > len(pipes):
+                            return "the path needs {} movable tiles, there are {}".format(c, len(pipes))
+                        return None
+        return "fixed tiles wall the initial tile off from the goal tile"
 
     def h(self, node):
         """
@@ -651,10 +926,13 @@ class RTBProblem(search.Problem):
         It can happen that a action (with a small heuristic value) causes a 
         state where the true cost is much greater that what we expect, since 
         we are very optimistic in the heuristic.
+
+        At a goal d2 is -1, as the walk from the goal tile reaches the
+        initial tile, so h is kept at 0 or above.
         """
-        # node.state tem o estado
-        loc_flow_init = self._follow_path_forward(node.state)
-        loc_flow_goal = self._follow_path_backward(node.state)
+        # node.state tem o estado, the walks are reused from node.parent
+        loc_flow_init = self._forward_walk(node).end
+        loc_flow_goal = self._backward_walk(node).end
         # loc_flow_end = calc_end_flow_from_goal
 
         # Manhattan distance = abs(x2-x1) + abs(y2-y1)
@@ -673,5 +951,267 @@ class RTBProblem(search.Problem):
             + abs(self.goal_tile_loc[0] - loc_flow_init[0])
             - 1
         )
-        return min(d1, d2, d3, self.init_goal_dist, 2)
+        return max(min(d1, d2, d3, self.init_goal_dist, 2), 0)
         # min_dist(init, flow_init, flow_goal, goal)
+
+    def _fitting_codes(self, codes: List[int], movable, cell: int, flows, targets) -> frozenset:
+        """
+        Return the codes of the movable tiles that can take the ball at
+        cell, arriving with each of *flows*. With a single flow, the other
+        opening must not lead off the board or into a fixed tile that would
+        stop the ball short of the *targets* codes.
+        """
+        N = self.N
+        needed = {sides[flow] for flow in flows}
+        fitting = set()
+        for code in {codes[n] for n in self._movable_cells}:
+            openings = tile_openings[code]
+            if len(openings) != 2 or not needed <= set(openings):
+                continue
+            if len(needed) == 1:
+                (out,) = set(openings) - needed
+                dy, dx, flow, _ = _exit_through(out)
+                y, x = cell // N + dy, cell % N + dx
+                if not self._in_bounds((y, x)):
+                    continue
+                if y * N + x not in movable:
+                    tile = codes[y * N + x]
+                    stop = flow_table[tile * 4 + flow][3]
+                    if stop == BREAK or (stop == END and tile not in targets):
+                        continue
+            fitting.add(code)
+        return frozenset(fitting)
+
+    def load_pdb(self, directory: Optional[str] = None, pattern_size: int = 10):
+        """
+        Load the pattern databases of h_pdb, building the missing ones.
+
+        The ball leaves the fixed tiles next to the initial tile at a first
+        movable cell, and those next to the goal tile at a last one (see
+        _fixed_chain). In every goal state these cells hold a tile that
+        fits (see _fitting_codes), so each gets a pattern: the region of
+        up to pattern_size movable cells closest to it, and the database of
+        abstract distances to a fitting tile there (see pattern_db).
+
+        A database only depends on the shape of its region, so boards with
+        the same fixed tiles share them. They are kept in *directory*,
+        ~/.cache/rtb-pdb by default, and memory-mapped.
+        """
+        if directory is None:
+            directory = os.path.join(os.path.expanduser("~"), ".cache", "rtb-pdb")
+        N = self.N
+        codes = self.decode(self.initial)
+        movable = set(self._movable_cells)
+        first, first_flow, _ = self._fixed_chain(codes, movable, self.init_tile_loc, goal_tile_codes)
+        last, last_flow, _ = self._fixed_chain(codes, movable, self.goal_tile_loc, initial_tile_codes)
+        if first is not None and first == last:
+            targets = [(first, self._fitting_codes(codes, movable, first, (first_flow, last_flow), ()))]
+        else:
+            targets = [
+                (cell, self._fitting_codes(codes, movable, cell, (flow,), ends))
+                for cell, flow, ends in ((first, first_flow, goal_tile_codes), (last, last_flow, initial_tile_codes))
+                if cell is not None
+            ]
+
+        self._patterns = []
+        regions = []
+        for target, fitting in targets:
+            region, todo = [target], collections.deque([target])
+            while todo and len(region) < pattern_size:
+                y, x = divmod(todo.popleft(), N)
+                for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+                    n = ny * N + nx
+                    if self._in_bounds((ny, nx)) and n in movable and n not in region and len(region) < pattern_size:
+                        region.append(n)
+                        todo.append(n)
+            neighbors = [
+                {(y + dy) * N + x + dx for dy, dx in side_delta.values() if self._in_bounds((y + dy, x + dx))}
+                for y, x in (divmod(n, N) for n in region)
+            ]
+            adjacent = [
+                (i, j) for i in range(len(region)) for j in range(i + 1, len(region)) if region[j] in neighbors[i]
+            ]
+            boundary = [i for i in range(len(region)) if (neighbors[i] & movable) - set(region)]
+            key = hashlib.blake2b(repr((len(region), adjacent, boundary)).encode(), digest_size=16).hexdigest()
+            table = pattern_db.load(directory, key, len(region), adjacent, boundary, 0)
+            weights = tuple(3 ** i for i in range(len(region)))
+            self._patterns.append((tuple(region), weights, fitting, table))
+            regions.append(set().union(region, *neighbors))
+        # a move changes the abstract state of at most one of two regions that do not touch
+        self._pdb_additive = len(targets) == 2 and not (regions[0] & set(self._patterns[1][0]))
+
+    def h_pdb(self, node):
+        """
+        Pattern database heuristic: the abstract distances of load_pdb,
+        added up when their regions do not touch and their max otherwise,
+        never less than h, and 0 at a goal. Each one is a lower bound on
+        the moves that change its region, so this is admissible.
+        """
+        if self.goal_test_node(node):
+            return 0
+        h = self.h(node)
+        if self._patterns is None:
+            self.load_pdb()
+        board = self._board_of(node.state)
+        tile_at = self._tile_at
+        values = []
+        for cells, weights, fitting, table in self._patterns:
+            index = 0
+            for cell, weight in zip(cells, weights):
+                code = tile_at(board, cell)
+                if code != EMPTY_CODE:
+                    index += weight * (pattern_db.MATCH if code in fitting else pattern_db.OTHER)
+            values.append(int(table[index]))
+        pdb = sum(values) if self._pdb_additive else max(values, default=0)
+        return max(pdb, h)
+
+    def _build_transport(self):
+        """
+        Find the cells of h_transport: the non-fixed cells every goal path
+        goes through. The first one after the fixed tiles next to the
+        initial tile (see _fixed_chain) must hold a fitting tile (see
+        _fitting_codes). When all of these leave it through the same side,
+        the ball surely goes on to the next non-fixed cell that way, which
+        is required too, and so on until the fitting tiles go different
+        ways. The same is done from the goal tile.
+
+        Stores the cells, which tile codes are compatible with each and the
+        slide distance from each movable cell to each of them: a tile only
+        moves through the movable cells of its region, one cell per move.
+        """
+        N = self.N
+        codes = self.decode(self.initial)
+        movable = set(self._movable_cells)
+        required = {}
+        for start, targets in ((self.init_tile_loc, goal_tile_codes), (self.goal_tile_loc, initial_tile_codes)):
+            cell, flow, _ = self._fixed_chain(codes, movable, start, targets)
+            while cell is not None and cell not in required:
+                fitting = self._fitting_codes(codes, movable, cell, (flow,), targets)
+                required[cell] = fitting
+                outs = {side for code in fitting for side in tile_openings[code] if side != sides[flow]}
+                if len(outs) != 1:
+                    break
+                cell, flow, _ = self._fixed_chain(codes, movable, divmod(cell, N), targets, outs.pop())
+
+        cells = tuple(required)
+        compatible = np.zeros((len(cells), 32), dtype=bool)
+        # unreachable cells cost more than any slide, which only a dead end adds up to
+        distance = np.full((len(cells), len(self._movable_cells)), N * N, dtype=np.intp)
+        column = {n: k for k, n in enumerate(self._movable_cells)}
+        for r, cell in enumerate(cells):
+            compatible[r, list(required[cell])] = True
+            distance[r, column[cell]] = 0
+            todo = collections.deque([cell])
+            while todo:
+                n = todo.popleft()
+                for neighbor, _ in self._moves[n]:
+                    if distance[r, column[neighbor]] == N * N:
+                        distance[r, column[neighbor]] = distance[r, column[n]] + 1
+                        todo.append(neighbor)
+        self._transport = (cells, compatible, distance)
+
+    def h_transport(self, node):
+        """
+        Tile transport heuristic. Each cell of _build_transport needs its
+        own compatible tile in every goal state, and a move slides one tile
+        by one cell, so the moves are at least the sum of the slide
+        distances of the tiles sent there. The cheapest assignment of
+        tiles to cells (min_cost_assignment) is then a lower bound on the
+        cost to go, and so is h, so their max is admissible. It is 0 at a
+        goal.
+        """
+        if self.goal_test_node(node):
+            return 0
+        h = self.h(node)
+        if self._transport is None:
+            self._build_transport()
+        cells, compatible, distance = self._transport
+        if not cells:
+            return h
+        board = self._board_of(node.state)
+        tile_at = self._tile_at
+        codes = np.fromiter((tile_at(board, n) for n in self._movable_cells), dtype=np.intp)
+        fits = compatible[:, codes]
+        # tiles fitting no cell never take part, unless too few are left
+        useful = fits.any(axis=0)
+        if useful.sum() >= len(cells):
+            fits, distance = fits[:, useful], distance[:, useful]
+        cost = np.where(fits, distance, self.N * self.N)
+        columns = cost.argmin(axis=1)
+        if len(set(columns.tolist())) < len(cells):
+            # the nearest tiles are not all different, solve the assignment
+            columns = min_cost_assignment(cost)
+        return max(int(cost[np.arange(len(cells)), columns].sum()), h)
+
+    def setAlgorithm(self, open_list: str = "heap"):
+        """
+        Sets the informed search algorithm chosen, A* with self.h.
+
+        open_list selects the frontier of search.best_first_graph_search:
+        "heap" for utils.IndexedPriorityQueue, or "bucket" for
+        utils.BucketQueue, one LIFO bucket per f value, which fits our unit
+        step costs and the small integers returned by h.
+        """
+        frontier_factory = {"heap": IndexedPriorityQueue, "bucket": BucketQueue}[open_list]
+        self.algorithm = functools.partial(search.astar_search, frontier_factory=frontier_factory)
+        self.optimal = True
+
+    def setPortfolio(self, searchers=("astar", "astar-deeper", "ucs", "bfs", "ida"),
+                     optimal=True, timeout=None):
+        """
+        Sets a portfolio of search algorithms, raced in parallel by solve().
+
+        searchers are names of PORTFOLIO entries, or a dict of name to
+        Searcher. Each one runs in its own process and solve() returns the
+        goal node of the first to finish, terminating the others; the name
+        of the winner is kept in self.portfolio_winner. With optimal, the
+        searchers that may return a costlier solution are left out.
+        timeout is in seconds, after which solve() raises TimeoutError.
+        """
+        if not isinstance(searchers, dict):
+            searchers = {name: PORTFOLIO[name] for name in searchers}
+        searchers = {
+            name: (functools.partial(_run_searcher, searcher), searcher.optimal)
+            for name, searcher in searchers.items()
+        }
+        self.algorithm = functools.partial(
+            self._portfolio_search, searchers=searchers, optimal=optimal, timeout=timeout
+        )
+        self.optimal = optimal or all(is_optimal for _, is_optimal in searchers.values())
+
+    def _portfolio_search(self, problem, searchers, optimal, timeout):
+        self.portfolio_winner, node = search.portfolio_search(problem, searchers, optimal, timeout)
+        return node
+
+    def setCache(self, cache: Union[str, SolutionCache]):
+        """
+        Sets a persistent SolutionCache, or the path of its file, checked by
+        solve() before searching and updated after. Pass None to stop using
+        it.
+        """
+        self.cache = SolutionCache(cache) if isinstance(cache, str) else cache
+
+    def cache_key(self) -> str:
+        """Hash of the size and tiles of the board, whatever the encoding."""
+        board = self.N.to_bytes(2, "big") + bytes(self.decode(self.initial))
+        return hashlib.blake2b(board, digest_size=16).hexdigest()
+
+    def solve(self, problem=None):
+        """
+        Calls the search algorithm chosen, unless the cache has the answer
+        (a solution as good as the algorithm would find, or no solution) or
+        unsolvable_reason rules the board out. The algorithm searches
+        *problem*, self by default, or e.g. a search.InstrumentedProblem
+        wrapping it.
+        """
+        if self.cache is not None:
+            entry = self.cache.get(self.cache_key(), self.optimal)
+            if entry is not None:
+                return None if entry.actions is None else search.replay(self, entry.actions)
+        if self.unsolvable_reason() is not None:
+            node, optimal = None, True
+        else:
+            node, optimal = self.algorithm(problem or self), self.optimal
+        if self.cache is not None:
+            self.cache.put(self.cache_key(), node, optimal)
+        return node
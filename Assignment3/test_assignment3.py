@@ -1,4 +1,40 @@
-from solution import RTBProblem
+import functools
+import gc
+import io
+import itertools
+import json
+import random
+
+import batch
+from cache import SolutionCache
+from solution import RTBProblem, Encoding, Searcher
+from search import (
+    astar_search,
+    batched_astar_search,
+    batched_breadth_first_search,
+    breadth_first_graph_search,
+    depth_first_graph_search,
+    greedy_best_first_graph_search,
+    hda_star_search,
+    ida_star_search,
+    InstrumentedProblem,
+    Node,
+    recursive_best_first_search,
+    sma_star_search,
+    uniform_cost_search,
+    _SMARecord,
+)
+from utils import BloomFilter, FingerprintSet, HeuristicCache, min_cost_assignment
+
+# a goal one move past the cheapest one would fit under f = g + h with h = -1 at goals
+LATE_GOAL_BOARD = (
+    "4\nleft-top-not left-top left-down no-passage-not\nright-down empty-cell right-top left-top\n"
+    "left-top no-passage right-down initial-top\nleft-top goal-top left-down empty-cell\n"
+)
+# the same on a board small enough for RBFS, cost 5 (6 if h were -1 at goals)
+SMALL_LATE_GOAL_BOARD = (
+    "3\nright-down goal-left empty-cell\nno-passage empty-cell initial-left\nright-left right-top no-passage\n"
+)
 
 def solve(fh):
     problem = RTBProblem()
@@ -23,8 +59,8 @@ def test_public_02():
 
 def test_public_03():
     with open("public_tests/pub03.dat") as fh:
-        # Not solvable
-        assert solve(fh) == 0
+        # Solvable, optimal cost 6
+        assert solve(fh) == 1
 
 def test_public_04():
     with open("public_tests/pub04.dat") as fh:
@@ -55,3 +91,418 @@ def test_public_10():
     with open("public_tests/pub10.dat") as fh:
         assert solve(fh) == 1
 
+
+def test_compact_encodings():
+    costs = set()
+    for encoding in Encoding:
+        problem = RTBProblem(encoding)
+        with open("public_tests/pub07.dat") as fh:
+            problem.load(fh)
+        with open("public_tests/pub07.dat") as fh:
+            rows = [line.split() for line in fh.read().splitlines()[1:]]
+        assert problem.tiles(problem.initial) == rows
+        costs.add(astar_search(problem).path_cost)
+    assert costs == {8}
+
+def test_track_empties():
+    problem = RTBProblem(Encoding.BYTE, track_empties=True)
+    with open("public_tests/pub10.dat") as fh:
+        problem.load(fh)
+    state = problem.initial
+    for _ in range(20):
+        board, empties = state
+        assert empties == tuple(n for n, code in enumerate(board) if code == 0b10110)
+        state = problem.result(state, problem.actions(state)[-1])
+    assert astar_search(problem).path_cost == 7
+
+def test_bucket_open_list():
+    for p_name in ("public_tests/pub07.dat", "public_tests/pub10.dat"):
+        costs = []
+        for open_list in ("heap", "bucket"):
+            problem = RTBProblem()
+            with open(p_name) as fh:
+                problem.load(fh)
+            problem.setAlgorithm(open_list)
+            costs.append(problem.solve().path_cost)
+        assert costs[0] == costs[1]
+
+def test_bucket_open_list_goal_h(tmp_path):
+    # h must not be -1 at goals, or reach the bucket queue as a negative f
+    solved = "3\ninitial-right right-left goal-left\nempty-cell right-left right-left\ntop-down empty-cell left-top\n"
+    for board, cost in ((solved, 0), (LATE_GOAL_BOARD, 12)):
+        problem = RTBProblem()
+        problem.load(io.StringIO(board))
+        problem.setAlgorithm("bucket")
+        assert problem.solve().path_cost == cost
+    path = tmp_path / "solved.dat"
+    path.write_text(solved)
+    record = batch.solve_puzzle(str(path), open_list="bucket")
+    assert record["status"] == "solved" and record["cost"] == 0
+
+def test_ida_star():
+    for p_name in ("public_tests/pub05.dat", "public_tests/pub10.dat"):
+        problem = RTBProblem()
+        with open(p_name) as fh:
+            problem.load(fh)
+        assert ida_star_search(problem).path_cost == astar_search(problem).path_cost
+
+def test_batch():
+    out = io.StringIO()
+    records = batch.run(
+        batch.puzzle_paths(["public_tests/pub0[1-4].dat"]), jobs=2, timeout=60, out=out
+    )
+    assert sorted(record["puzzle"] for record in records) == [
+        "public_tests/pub0{}.dat".format(n) for n in range(1, 5)
+    ]
+    assert all(record["status"] == "solved" for record in records)
+    assert [json.loads(line)["cost"] for line in out.getvalue().splitlines()] == [
+        record["cost"] for record in records
+    ]
+    record = batch.solve_puzzle("public_tests/pub10.dat", max_nodes=10)
+    assert record["status"] == "node-budget" and record["nodes"] == 10
+
+def test_portfolio():
+    for n, cost in ((1, 3), (7, 8), (10, 7)):
+        problem = RTBProblem()
+        with open("public_tests/pub{:02d}.dat".format(n)) as fh:
+            problem.load(fh)
+        problem.setPortfolio(timeout=60)
+        node = problem.solve()
+        assert node.path_cost == cost and problem.goal_test(node.state)
+        assert problem.portfolio_winner in ("astar", "astar-deeper", "ucs", "bfs", "ida")
+    problem.setPortfolio(["greedy", "weighted-astar"], optimal=False, timeout=60)
+    assert problem.goal_test(problem.solve().state)
+    # searchers marked optimal must return the optimum on the late-goal boards
+    for name, board, cost in (
+        ("astar-deeper", LATE_GOAL_BOARD, 12),
+        ("ida", LATE_GOAL_BOARD, 12),
+        ("rbfs", SMALL_LATE_GOAL_BOARD, 5),
+    ):
+        problem = RTBProblem()
+        problem.load(io.StringIO(board))
+        problem.setPortfolio([name], timeout=60)
+        assert problem.solve().path_cost == cost
+
+def test_hda_star():
+    for n, cost in ((2, 12), (7, 8), (10, 7)):
+        problem = RTBProblem()
+        with open("public_tests/pub{:02d}.dat".format(n)) as fh:
+            problem.load(fh)
+        node = hda_star_search(problem, workers=3, batch_size=8)
+        assert node.path_cost == cost and problem.goal_test(node.state)
+
+def test_batched_search():
+    for encoding in (Encoding.ASCII, Encoding.BYTE, Encoding.PACKED):
+        problem = RTBProblem(encoding)
+        with open("public_tests/pub07.dat") as fh:
+            problem.load(fh)
+        states = [problem.initial] + [
+            problem.result(problem.initial, action) for action in problem.actions(problem.initial)
+        ]
+        children, parents, codes = problem.expand_batch(problem.to_array(states))
+        assert list(zip(parents.tolist(), problem.from_array(children))) == [
+            (k, problem.result(state, action))
+            for k, state in enumerate(states)
+            for action in problem.actions(state)
+        ]
+        assert [problem.action_from_code(code) for code in codes[parents == 0]] == list(
+            problem.actions(problem.initial)
+        )
+        for search in (batched_breadth_first_search, batched_astar_search):
+            node = search(problem)
+            assert node.path_cost == 8 and problem.goal_test(node.state)
+
+def test_walk_batch():
+    problem = RTBProblem(Encoding.BYTE)
+    with open("public_tests/pub10.dat") as fh:
+        problem.load(fh)
+    states, frontier = [problem.initial], [problem.initial]
+    for _ in range(3):
+        frontier = [problem.result(state, action) for state in frontier for action in problem.actions(state)]
+        states.extend(frontier)
+    boards = problem.to_array(states)
+    reached, ends = problem.walk_batch(boards)
+    assert reached.tolist() == [problem.goal_test(state) for state in states]
+    assert [tuple(end) for end in ends] == [problem._follow_path_forward(state) for state in states]
+    ends = problem.walk_batch(boards, backward=True)[1]
+    assert [tuple(end) for end in ends] == [problem._follow_path_backward(state) for state in states]
+    assert problem.h_batch(boards).tolist() == [problem.h(Node(state)) for state in states]
+
+def test_solution_cache(tmp_path):
+    path = str(tmp_path / "solutions.sqlite")
+    for n in (10, 7, 10):
+        problem = RTBProblem()
+        with open("public_tests/pub{:02d}.dat".format(n)) as fh:
+            problem.load(fh)
+        problem.setAlgorithm()
+        problem.setCache(SolutionCache(path, max_entries=1))
+        node = problem.solve()
+        assert node.path_cost == {7: 8, 10: 7}[n] and problem.goal_test(node.state)
+        # pub07 evicted pub10, the least recently used entry
+        assert (problem.cache.hits, len(problem.cache)) == (0, 1)
+    problem = RTBProblem(Encoding.PACKED)
+    with open("public_tests/pub10.dat") as fh:
+        problem.load(fh)
+    problem.algorithm = None
+    problem.setCache(path)
+    assert problem.solve().path_cost == 7 and problem.cache.hits == 1
+
+def test_unsolvable_reason():
+    for board, reason in (
+        # every movable tile is frozen, and the goal tile opens off the board
+        ("4\nright-down-not right-left right-left left-down\nright-top left-down initial-right left-top-not\n"
+         "top-down right-top left-down-not empty-cell\ngoal-left right-left left-top no-passage-not\n",
+         "the path from (1, 2) hits the closed fixed tile at (3, 0)"),
+        # the initial tile opens into a closed fixed tile
+        ("3\ninitial-right top-down-not goal-left\nempty-cell right-left right-left\ntop-down empty-cell left-top\n",
+         "the path from (0, 0) hits the closed fixed tile at (0, 1)"),
+        # fixed tiles on both sides of the initial tile's row
+        ("3\ninitial-down empty-cell goal-down\nno-passage-not no-passage-not right-left-not\n"
+         "right-left top-down left-top\n",
+         "the path from (0, 0) hits the closed fixed tile at (1, 0)"),
+        # a single movable pipe cannot join them
+        ("3\ninitial-right empty-cell empty-cell\nno-passage no-passage right-left\nempty-cell empty-cell goal-left\n",
+         "the path needs 3 movable tiles, there are 1"),
+    ):
+        problem = RTBProblem()
+        problem.load(io.StringIO(board))
+        problem.setAlgorithm()
+        assert problem.unsolvable_reason() == reason
+        assert astar_search(problem) is None and problem.solve() is None
+    for n in range(1, 11):
+        problem = RTBProblem()
+        with open("public_tests/pub{:02d}.dat".format(n)) as fh:
+            problem.load(fh)
+        assert problem.unsolvable_reason() is None
+
+def test_drop_static():
+    with open("public_tests/pub10.dat") as fh:
+        board = fh.read()
+    full = RTBProblem(Encoding.BYTE)
+    full.load(io.StringIO(board))
+    for encoding in Encoding:
+        problem = RTBProblem(encoding, drop_static=True)
+        problem.load(io.StringIO(board))
+        # the no-passage tiles fenced in by the walls can never move
+        assert 21 in problem.frozen_cells and 21 not in problem._movable_cells
+        assert problem.decode(problem.initial) == full.decode(full.initial)
+        if encoding == Encoding.BYTE:
+            assert len(problem.initial) == len(problem._movable_cells) == 15
+        state = problem.initial
+        for _ in range(10):
+            assert problem.to_array([state])[0].tolist() == problem.decode(state)
+            assert problem.from_array(problem.to_array([state])) == [state]
+            state = problem.result(state, problem.actions(state)[0])
+        assert astar_search(problem).path_cost == 7
+
+def test_prune_commuting():
+    for p_name, cost in (("public_tests/pub07.dat", 8), ("public_tests/pub10.dat", 7)):
+        generated = []
+        for prune_commuting in (False, True):
+            problem = RTBProblem(prune_commuting=prune_commuting)
+            with open(p_name) as fh:
+                problem.load(fh)
+            instrumented = InstrumentedProblem(problem)
+            for search in (astar_search, breadth_first_graph_search):
+                assert search(instrumented).path_cost == cost
+            generated.append(instrumented.states)
+        assert generated[1] < generated[0]
+
+def test_pattern_database(tmp_path):
+    directory = str(tmp_path)
+    for n, cost in ((5, 10), (8, 7), (10, 7)):
+        problem = RTBProblem()
+        with open("public_tests/pub{:02d}.dat".format(n)) as fh:
+            problem.load(fh)
+        problem.load_pdb(directory)
+        node = astar_search(problem, h=problem.h_pdb)
+        assert node.path_cost == cost and problem.goal_test(node.state)
+        for step in node.path():
+            assert problem.h(step) <= problem.h_pdb(Node(step.state)) <= cost - step.path_cost
+        assert problem.h_pdb(Node(node.state)) == 0
+    # boards with the same fixed tiles reuse the saved databases
+    files = sorted(tmp_path.iterdir())
+    with open("public_tests/pub10.dat") as fh:
+        problem.load(fh)
+    problem.load_pdb(directory)
+    assert sorted(tmp_path.iterdir()) == files
+
+def test_pattern_database_reload(tmp_path, monkeypatch):
+    # h_pdb loads the databases of the board it was last loaded with
+    monkeypatch.setenv("HOME", str(tmp_path))
+    problem = RTBProblem()
+    for n, cost in ((5, 10), (8, 7)):
+        with open("public_tests/pub{:02d}.dat".format(n)) as fh:
+            problem.load(fh)
+        assert astar_search(problem, h=problem.h_pdb).path_cost == cost
+
+def test_transport_heuristic():
+    cost = [[4, 1, 3, 9], [2, 0, 5, 9], [3, 2, 2, 9]]
+    columns = min_cost_assignment(cost)
+    assert sum(cost[i][j] for i, j in enumerate(columns)) == min(
+        sum(cost[i][j] for i, j in enumerate(p)) for p in itertools.permutations(range(4), 3)
+    ) == 5
+    for n, cost in ((1, 3), (5, 10), (8, 7)):
+        problem = RTBProblem()
+        with open("public_tests/pub{:02d}.dat".format(n)) as fh:
+            problem.load(fh)
+        generated = []
+        for h in (problem.h, problem.h_transport):
+            instrumented = InstrumentedProblem(problem)
+            node = astar_search(instrumented, h=h)
+            assert node.path_cost == cost and problem.goal_test(node.state)
+            generated.append(instrumented.states)
+        assert generated[1] < generated[0]
+        for step in node.path():
+            assert problem.h(step) <= problem.h_transport(Node(step.state)) <= cost - step.path_cost
+        assert problem.h_transport(Node(node.state)) == 0
+
+def test_heuristic_cache():
+    problem = RTBProblem()
+    with open("public_tests/pub08.dat") as fh:
+        problem.load(fh)
+    cache = HeuristicCache()
+    assert recursive_best_first_search(problem, h_cache=cache).path_cost == 7
+    # RBFS expands the same states over and over
+    assert cache.misses == len(cache) and cache.hits > 10 * cache.misses
+    hits = cache.hits
+    assert astar_search(problem, h_cache=cache).path_cost == 7 and cache.hits > hits
+    small = HeuristicCache(max_bytes=100 * HeuristicCache.ENTRY_BYTES)
+    assert problem.goal_test(greedy_best_first_graph_search(problem, h_cache=small).state)
+    assert small.evictions > 0 and 0 < small.bytes <= small.max_bytes
+
+def test_sma_star(tmp_path):
+    for n, cost in ((5, 10), (8, 7)):
+        problem = RTBProblem()
+        with open("public_tests/pub{:02d}.dat".format(n)) as fh:
+            problem.load(fh)
+        for budget in ({}, {"max_nodes": 200}, {"max_bytes": 200000}):
+            node = sma_star_search(problem, **budget)
+            assert node.path_cost == cost and problem.goal_test(node.state)
+    # the cheapest path does not fit, which is not proof that there is none
+    assert sma_star_search(problem, max_nodes=5) == "cutoff"
+    problem.setAlgorithm()
+    problem.algorithm = functools.partial(sma_star_search, max_nodes=5)
+    problem.setCache(SolutionCache(str(tmp_path / "solutions.sqlite")))
+    assert problem.solve() == "cutoff" and len(problem.cache) == 0
+    problem.setPortfolio({"sma": Searcher(functools.partial(sma_star_search, max_nodes=5), True),
+                          "astar": Searcher(astar_search, True)}, timeout=60)
+    assert problem.solve().path_cost == 7 and problem.portfolio_winner == "astar"
+    # forgotten nodes are freed, stale heap entries do not keep them
+    problem = RTBProblem()
+    with open("public_tests/pub05.dat") as fh:
+        problem.load(fh)
+    calls, peak = itertools.count(), []
+
+    def h(node):
+        if next(calls) % 500 == 0:
+            gc.collect()
+            peak.append(sum(type(o) is _SMARecord for o in gc.get_objects()))
+        return problem.h(node)
+
+    assert sma_star_search(problem, h=h, max_nodes=100).path_cost == 10
+    assert len(peak) > 5 and max(peak) <= 5 * 100
+
+def test_fingerprint_set():
+    problem = RTBProblem()
+    with open("public_tests/pub10.dat") as fh:
+        problem.load(fh)
+    for search in (breadth_first_graph_search, astar_search):
+        reached = set()
+        cost = search(problem, explored=reached).path_cost
+        for verify in (False, True):
+            explored = FingerprintSet(capacity=1, verify=verify)
+            assert search(problem, explored=explored).path_cost == cost
+            assert len(explored) == len(reached) and all(state in explored for state in reached)
+            assert len(explored.table) <= 4 * len(explored)
+    problem = RTBProblem()
+    with open("public_tests/pub02.dat") as fh:
+        problem.load(fh)
+    assert problem.goal_test(depth_first_graph_search(problem, explored=FingerprintSet()).state)
+
+def test_bloom_filter():
+    problem = RTBProblem()
+    with open("public_tests/pub09.dat") as fh:
+        problem.load(fh)
+    for search in (breadth_first_graph_search, astar_search):
+        reached = set()
+        cost = search(problem, explored=reached).path_cost
+        explored = BloomFilter(1 << 16, hashes=4)
+        assert search(problem, explored=explored).path_cost == cost
+        report = explored.report()
+        assert report["states"] == len(reached) and report["bytes"] == 1 << 16
+        assert 0 < report["fill_ratio"] < 0.05 and report["false_positive_rate"] < 1e-6
+        assert all(state in explored for state in reached)
+        # too small: nearly every state looks explored, and the goal is missed
+        explored = BloomFilter(64, hashes=4)
+        assert search(problem, explored=explored) is None
+        assert explored.report()["fill_ratio"] > 0.9 and len(explored) < len(reached)
+
+def test_late_goal_prefer_deeper():
+    problem = RTBProblem()
+    problem.load(io.StringIO(LATE_GOAL_BOARD))
+    assert breadth_first_graph_search(problem).path_cost == 12
+    for prefer_deeper in (False, True):
+        node = astar_search(problem, prefer_deeper=prefer_deeper)
+        assert node.path_cost == 12
+    # h is 0 at a goal, not the -1 of the walk from the goal tile
+    assert problem.h(Node(node.state)) == 0
+    assert problem.h_batch(problem.to_array([node.state])).tolist() == [0]
+
+
+def test_astar_goals_first():
+    # h is 0 all along the path of pub01, the goal must not wait behind the other nodes with its f
+    problem = RTBProblem()
+    with open("public_tests/pub01.dat") as fh:
+        problem.load(fh)
+    generated = []
+    for search in (astar_search, uniform_cost_search):
+        instrumented = InstrumentedProblem(problem)
+        assert search(instrumented).path_cost == 3
+        generated.append(instrumented.states)
+    assert generated[0] < generated[1] // 2
+
+
+def test_late_goal_ida_star():
+    problem = RTBProblem()
+    problem.load(io.StringIO(LATE_GOAL_BOARD))
+    assert ida_star_search(problem).path_cost == 12
+
+
+def test_ida_star_unsolvable():
+    # passes unsolvable_reason, the bound must stop rising once every state is in the table
+    problem = RTBProblem()
+    problem.load(io.StringIO(
+        "3\ninitial-down right-down top-down-not\nempty-cell top-down empty-cell\ntop-down no-passage goal-top\n"
+    ))
+    assert problem.unsolvable_reason() is None and breadth_first_graph_search(problem) is None
+    problem.setPortfolio(["ida"], timeout=30)
+    assert problem.solve() is None
+
+
+def test_incremental_walks():
+    # the walks of a node resume from its parent's, through chains of prefixes
+    rng = random.Random(5)
+    for board in ("public_tests/pub07.dat", "public_tests/pub10.dat", LATE_GOAL_BOARD):
+        if board.endswith(".dat"):
+            with open(board) as fh:
+                board = fh.read()
+        for encoding, track_empties, drop_static in itertools.product(Encoding, (False, True), (False, True)):
+            problem = RTBProblem(encoding, track_empties=track_empties, drop_static=drop_static)
+            problem.load(io.StringIO(board))
+            paths = [astar_search(problem).path()]
+            for _ in range(5):
+                node = Node(problem.initial)
+                for _ in range(60):
+                    node = node.child_node(problem, rng.choice(problem.actions(node.state)))
+                paths.append(node.path())
+            for path in paths:
+                for node in path:
+                    # some walks start afresh, when the parent's was never needed
+                    if rng.random() < 0.1:
+                        continue
+                    state = node.state
+                    assert problem.goal_test_node(node) == problem.goal_test(state)
+                    assert problem._forward_walk(node).end == problem._follow_path_forward(state)
+                    assert problem._backward_walk(node).end == problem._follow_path_backward(state)
+                assert problem.goal_test_node(path[-1]) == problem.goal_test(path[-1].state)